@@ -0,0 +1,106 @@
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from cache import LRUTTLCache
+
+
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """In-process LRU of answers, optionally written through to disk or MongoDB.
+
+    ``backend`` is "memory", "disk" (a SQLite file at ``path``) or "mongo" (the
+    collection returned by the ``collection`` callable, expired by a TTL index;
+    a callable so each forked worker resolves its own client). Persistent
+    entries survive restarts and are shared by workers pointing at the same
+    store: each worker opens its own SQLite connection (WAL mode, so readers
+    never block the writer) or MongoDB client. Lookups go to memory first and
+    only fall through on a miss.
+    """
+
+    def __init__(self, maxsize=512, ttl=3600, backend="memory", path=None, collection=None):
+        self.memory = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.backend = backend
+        self.persistent_hits = 0
+        self._lock = threading.Lock()
+        self._path = path if backend == "disk" else None
+        self._conn = None
+        self._pid = None
+        self._collection = None
+        if backend == "mongo":
+            self._collection = collection
+            self._collection().create_index("created_at", expireAfterSeconds=int(ttl))
+
+    def _db(self):
+        # Opened lazily: SQLite connections must not cross fork(), so each worker opens its own
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers "
+                "(key TEXT PRIMARY KEY, answer TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl,))
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        value = self._load(key)
+        if value is not None:
+            self.persistent_hits += 1
+            self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        try:
+            self._store(key, value)
+        except Exception as e:
+            print(f"❌ Could not persist cached answer: {e}")
+
+    def _load(self, key):
+        try:
+            if self._path is not None:
+                with self._lock:
+                    entry = self._db().execute(
+                        "SELECT answer FROM answers WHERE key = ? AND created_at >= ?",
+                        (key, time.time() - self.ttl),
+                    ).fetchone()
+                if entry:
+                    return entry[0]
+            elif self._collection is not None:
+                entry = self._collection().find_one({"_id": key}, {"answer": 1})
+                if entry:
+                    return entry["answer"]
+        except Exception as e:
+            print(f"❌ Could not read cached answer: {e}")
+        return None
+
+    def _store(self, key, value):
+        if self._path is not None:
+            with self._lock:
+                conn = self._db()
+                conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?)", (key, value, time.time()))
+                conn.commit()
+        elif self._collection is not None:
+            self._collection().replace_one(
+                {"_id": key},
+                {"_id": key, "answer": value, "created_at": datetime.datetime.now(datetime.timezone.utc)},
+                upsert=True,
+            )
+
+    def stats(self):
+        return {**self.memory.stats(), "backend": self.backend, "persistent_hits": self.persistent_hits}
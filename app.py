@@ -1,40 +1,140 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from chatbot import get_response
+from chatbot import ServerBusy, get_response, new_session_id, stream_response, llm_stats, start_vector_registry, start_vector_watcher, vector_store_stats, query_embedding_cache_stats, retrieval_stats, route_stats, answer_cache_stats, session_memory_stats
+from structured_queries import list_entity_page, parse_cursor, prepare_indexes
+from metrics import profiled, should_profile, snapshot as metrics_snapshot
 from dotenv import load_dotenv
+import json
+import logging
 import os
-import uuid
 
 # Load environment variables
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
 app = Flask(__name__)
+# ?profile=1 returns a cProfile report with the answer; off unless explicitly allowed
+ALLOW_PROFILE_PARAM = os.getenv("ALLOW_PROFILE_PARAM") == "1"
+# Sent with 429 responses when the LLM queue is full
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})  # Restrict CORS to React app
 
+# Indexes backing the structured (non-RAG) queries
+prepare_indexes()
+
+# Load every FAISS index once. The watcher that reloads changed ones starts in
+# each gunicorn worker (post_fork) or below for the dev server, never in the
+# preloading master: it would poll for nothing and could fork mid-refresh.
+start_vector_registry(watch=False)
+
+def paging(data):
+    """``(page, cursor)`` from a JSON body or query string; ValueError when either is malformed."""
+    try:
+        page = int(data.get("page", 1))
+    except (TypeError, ValueError):
+        raise ValueError("page must be an integer")
+    if page < 1:
+        raise ValueError("page must be 1 or more")
+    cursor = data.get("cursor") or None
+    if cursor is not None:
+        parse_cursor(cursor)
+    return page, cursor
+
 @app.route("/api/chat", methods=["POST"])
 def chat():
     data = request.get_json()
     question = data.get("question")
-    session_id = data.get("session_id", str(uuid.uuid4()))
+    session_id = data.get("session_id") or new_session_id()
     
     if not question:
         return jsonify({"error": "Question is required"}), 400
+    # Paging for "list ..." questions: page number and/or the previous page's next_cursor
+    try:
+        page, cursor = paging(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
+    requested = ALLOW_PROFILE_PARAM and request.args.get("profile") == "1"
     try:
-        answer = get_response(question, session_id)
-        print("answer", answer)
-        return jsonify({
+        with profiled(should_profile(requested)) as profile:
+            answer = get_response(question, session_id, page, cursor)
+        body = {
             "question": question,
             "answer": answer,
-            "session_id": session_id
-        })
+            "session_id": session_id,
+            "next_cursor": getattr(answer, "next_cursor", None),
+        }
+        if profile["report"]:
+            if requested:
+                body["profile"] = profile["report"]
+            else:
+                logger.info("Sampled profile for %r:\n%s", question, profile["report"])
+        return jsonify(body)
+    except ServerBusy as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(RETRY_AFTER_SECONDS)}
     except Exception as e:
         print("error", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/chat/stream", methods=["GET", "POST"])
+def chat_stream():
+    # POST takes the same JSON body as /api/chat; GET takes query parameters for EventSource
+    data = request.get_json(silent=True) or request.args
+    question = data.get("question")
+    session_id = data.get("session_id") or new_session_id()
+
+    if not question:
+        return jsonify({"error": "Question is required"}), 400
+    try:
+        page, cursor = paging(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def events():
+        yield f"event: session\ndata: {json.dumps({'session_id': session_id})}\n\n"
+        for event, payload in stream_response(question, session_id, page, cursor):
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/api/list/<entity>", methods=["GET"])
+def list_entity(entity):
+    try:
+        page, cursor = paging(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    result = list_entity_page(entity, page, cursor)
+    if result is None:
+        return jsonify({"error": f"Unknown entity '{entity}'"}), 404
+    return jsonify(result)
+
 @app.route("/api/health", methods=["GET"])
 def health():
     return jsonify({"status": "healthy", "message": "API is running"}), 200
 
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    # Per-stage latency histograms (milliseconds) over the most recent requests
+    return jsonify(metrics_snapshot()), 200
+
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "vector_stores": vector_store_stats(),
+        "query_embedding_cache": query_embedding_cache_stats(),
+        "retrieval": retrieval_stats(),
+        "routes": route_stats(),
+        "answer_cache": answer_cache_stats(),
+        "llm": llm_stats(),
+        "sessions": session_memory_stats(),
+    }), 200
+
 if __name__ == "__main__":
+    # Development server only; production runs under gunicorn (gunicorn -c gunicorn.conf.py wsgi:app)
+    start_vector_watcher()
     print("Starting Flask server on http://0.0.0.0:4000")
-    app.run(debug=True, host="0.0.0.0", port=4000)
\ No newline at end of file
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1", host="0.0.0.0", port=4000, threaded=True)
\ No newline at end of file
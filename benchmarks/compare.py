@@ -0,0 +1,66 @@
+"""Compare two benchmark result files: python -m benchmarks.compare OLD.json NEW.json"""
+import argparse
+import json
+import sys
+
+
+def flatten(data, prefix=""):
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def direction(name):
+    """+1 when higher is better, -1 when lower is better, None for plain counts."""
+    leaf = name.rsplit(".", 1)[-1]
+    if leaf.endswith("_per_second"):
+        return 1
+    if leaf.endswith("_ms") or leaf.endswith("seconds") or leaf.endswith("_mb"):
+        return -1
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent change counted as a regression (default: 10)")
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    old.pop("meta", None)
+    new.pop("meta", None)
+    old_flat, new_flat = flatten(old), flatten(new)
+
+    regressions = []
+    print(f"{'metric':<60} {'old':>12} {'new':>12} {'change':>9}")
+    for name in sorted(old_flat.keys() & new_flat.keys()):
+        better = direction(name)
+        if better is None:
+            continue
+        before, after = old_flat[name], new_flat[name]
+        change = (after - before) / before * 100 if before else 0.0
+        marker = ""
+        if -better * change > args.threshold:
+            marker = "  ⚠️"
+            regressions.append(name)
+        print(f"{name:<60} {before:>12.2f} {after:>12.2f} {change:>+8.1f}%{marker}")
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} metrics regressed by more than {args.threshold:g}%")
+        return 1
+    print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
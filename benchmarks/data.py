@@ -0,0 +1,66 @@
+import random
+from datetime import datetime, timedelta
+
+SEED_BATCH_SIZE = 5000
+FIRST_ORDER_DATE = datetime(2024, 1, 1)
+ADJECTIVES = ["Premium", "Organic", "Grain-free", "Deluxe", "Compact", "Durable", "Soft", "Natural"]
+ITEMS = ["Dog Food", "Cat Litter", "Bird Cage", "Fish Tank", "Chew Toy", "Leash", "Pet Bed", "Scratching Post"]
+STATUSES = ["pending", "shipped", "delivered", "cancelled"]
+
+
+def _insert(collection, docs):
+    for i in range(0, len(docs), SEED_BATCH_SIZE):
+        collection.insert_many(docs[i:i + SEED_BATCH_SIZE], ordered=False)
+
+
+def seed(db, products=10000, seed=0):
+    """Fill ``db`` with synthetic pet-store data shaped like the production collections.
+
+    ``products`` sets the scale: there are as many orders as products and one
+    user/customer per ten products. Returns the document count per collection.
+    """
+    rng = random.Random(seed)
+    n_users = max(products // 10, 1)
+
+    # Lowercase: questions are lowercased and mongomock ignores the case-insensitive collation
+    categories = [{"name": f"category {i}"} for i in range(20)]
+    _insert(db["categories"], categories)
+    subcategories = [
+        {"name": f"Subcategory {c}-{j}", "categoryId": category["_id"]}
+        for c, category in enumerate(categories) for j in range(5)
+    ]
+    _insert(db["subcategories"], subcategories)
+
+    _insert(db["products"], [
+        {
+            "productName": f"{rng.choice(ADJECTIVES)} {rng.choice(ITEMS)} {i}",
+            "description": f"{rng.choice(ADJECTIVES)} product for pets, item number {i}.",
+            "price": round(rng.uniform(2, 300), 2),
+            "originalPrice": round(rng.uniform(300, 400), 2),
+            "discount": rng.choice([0, 5, 10, 20]),
+            "quantity": rng.randint(0, 500),
+            "categoryId": rng.choice(categories)["_id"],
+        }
+        for i in range(products)
+    ])
+
+    users = [{"name": f"User {i}", "email": f"user{i}@example.com"} for i in range(n_users)]
+    _insert(db["users"], users)
+    _insert(db["customers"], [
+        {"name": f"Customer {i}", "email": f"customer{i}@example.com", "city": f"City {i % 50}"}
+        for i in range(n_users)
+    ])
+
+    orders = []
+    for i in range(products):
+        user = rng.choice(users)
+        orders.append({
+            "userId": user["_id"],
+            "user": {"name": user["name"]},
+            "createdAt": FIRST_ORDER_DATE + timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+            "amount": round(rng.uniform(5, 900), 2),
+            "orderStatus": rng.choice(STATUSES),
+        })
+    _insert(db["orders"], orders)
+
+    return {name: db[name].estimated_document_count() for name in db.list_collection_names()}
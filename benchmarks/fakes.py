@@ -0,0 +1,32 @@
+import time
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+# Same dimensionality as models/embedding-001
+EMBEDDING_SIZE = 768
+
+
+class SlowFakeEmbedding(DeterministicFakeEmbedding):
+    """Deterministic vectors (same text, same vector) with a fixed delay per API call."""
+
+    latency: float = 0.0
+
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_query(text)
+
+
+def fake_embeddings(latency=0.0, size=EMBEDDING_SIZE):
+    return SlowFakeEmbedding(size=size, latency=latency)
+
+
+def fake_llm(latency=0.0, answer="This is a benchmark answer about the pet store."):
+    # invoke() sleeps once per call; stream() sleeps per character
+    return FakeListChatModel(responses=[answer], sleep=latency or None)
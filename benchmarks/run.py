@@ -0,0 +1,277 @@
+"""Offline benchmarks for ingestion, chat latency under load and structured queries.
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.run --products 10000 --output before.json
+    python -m benchmarks.compare before.json after.json
+
+Gemini and the embedding API are replaced by deterministic fakes with
+configurable latency. MongoDB is mongomock unless --mongo-uri points at a
+local server. Either way the data is synthetic and lives in its own database
+(dropped first), so nothing touches the production store.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+BENCHMARK_DB_NAME = "chatbot-benchmark"
+
+# RAG questions with no structured intent; {i} keeps them distinct so the answer cache never hits
+CHAT_QUESTIONS = [
+    "Tell me about the Premium Dog Food {i}",
+    "Which products are good for a new kitten, option {i}?",
+    "What did User {i} order recently?",
+    "Is the Durable Chew Toy {i} in stock?",
+]
+
+
+def _configure(args):
+    """Point the app at temporary storage and local stand-ins before its modules are imported."""
+    vector_dir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    os.environ["VECTOR_STORE_DIR"] = vector_dir
+    os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+    os.environ.setdefault("ANSWER_CACHE_BACKEND", "memory")
+    # Retries would only hide problems in a benchmark
+    os.environ.setdefault("INGEST_EMBED_MAX_RETRIES", "0")
+
+    import mongo
+    mongo.DB_NAME = BENCHMARK_DB_NAME
+    if args.mongo_uri:
+        mongo.MONGODB_URI = args.mongo_uri
+        backend = "mongodb"
+    else:
+        import mongomock
+        _patch_mongomock()
+        client = mongomock.MongoClient()
+        mongo.MongoClient = lambda *a, **k: client
+        backend = "mongomock"
+    mongo.get_client().drop_database(BENCHMARK_DB_NAME)
+    return vector_dir, backend
+
+
+def _patch_mongomock():
+    # pymongo >= 4.9 passes sort= to UpdateOne; mongomock 4.x does not accept it yet
+    import mongomock.collection
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def _add_update(self, *a, sort=None, **k):
+        return add_update(self, *a, **k)
+
+    mongomock.collection.BulkOperationBuilder.add_update = _add_update
+
+
+def _install_fakes(module, embeddings=None, llm=None):
+    if embeddings is not None:
+        module.embeddings = embeddings
+    if llm is not None:
+        module.llm = llm
+
+
+def latency_summary(samples):
+    from metrics import Histogram
+    histogram = Histogram(window=max(len(samples), 1))
+    for seconds in samples:
+        histogram.observe(seconds)
+    return histogram.snapshot()
+
+
+# --- Ingestion ---
+def bench_ingest(ingest, collections, workers):
+    def run(full_rebuild):
+        started = time.perf_counter()
+        results = []
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            futures = [pool.submit(ingest.ingest_collection, name, full_rebuild) for name in collections]
+            for future in as_completed(futures):
+                results.append(future.result())
+        return results, time.perf_counter() - started
+
+    results, seconds = run(full_rebuild=True)
+    documents = sum(r["documents"] for r in results)
+    # A second pass over unchanged data measures the incremental path (nothing to embed)
+    _, incremental_seconds = run(full_rebuild=False)
+    return {
+        "documents": documents,
+        "seconds": round(seconds, 3),
+        "docs_per_second": round(documents / seconds, 1) if seconds else 0.0,
+        "incremental_seconds": round(incremental_seconds, 3),
+        "peak_rss_mb": round(ingest.peak_rss_mb(), 1),
+        "collections": {
+            r["collection"]: {
+                "status": r["status"],
+                "documents": r["documents"],
+                "seconds": r["seconds"],
+                "docs_per_second": round(r["documents"] / r["seconds"], 1) if r["seconds"] else 0.0,
+            }
+            for r in sorted(results, key=lambda r: r["collection"])
+        },
+    }
+
+
+# --- Chat ---
+def bench_chat(chatbot, requests, concurrency):
+    import metrics
+    chatbot.start_vector_registry()
+    # Warm-up: first-use costs (index load, thread pools) are not what we want to measure
+    chatbot.get_response("warm up question about pets", None)
+    metrics.reset()
+
+    outcomes = {"ok": 0, "error": 0, "busy": 0}
+
+    def one(question):
+        started = time.perf_counter()
+        try:
+            answer = chatbot.get_response(question, None)
+            outcome = "ok" if isinstance(answer, str) else "error"
+        except chatbot.ServerBusy:
+            outcome = "busy"
+        return time.perf_counter() - started, outcome
+
+    questions = [CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)].format(i=i) for i in range(requests)]
+    latencies = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for seconds, outcome in pool.map(one, questions):
+            latencies.append(seconds)
+            outcomes[outcome] += 1
+    wall = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(wall, 3),
+        "requests_per_second": round(requests / wall, 2) if wall else 0.0,
+        "outcomes": outcomes,
+        "latency": latency_summary(latencies),
+        "stages": metrics.snapshot(),
+    }
+
+
+# --- Structured queries ---
+# Answers that mean the lookup found nothing; timing those measures the wrong path
+MISS_PREFIXES = ("No ", "Sorry", "Invalid")
+
+
+def structured_questions(db):
+    """One question per intent, built from seeded documents so every lookup has a hit."""
+    order = db["orders"].find_one({}, {"_id": 1, "userId": 1, "createdAt": 1})
+    user = db["users"].find_one({"_id": order["userId"]}, {"email": 1})
+    subcategory = db["subcategories"].find_one({}, {"categoryId": 1})
+    category = db["categories"].find_one({"_id": subcategory["categoryId"]}, {"name": 1})
+    day = order["createdAt"]
+    week_later = day + timedelta(days=7)
+    return {
+        "count": "How many products?",
+        "list": "List all products",
+        "list_subcategories_by_category": f"Show subcategories under the {category['name']} category",
+        "list_orders_by_user": f"Show orders for user {user['email']}",
+        "order_by_id": f"Order details for order id {order['_id']}",
+        "orders_by_date": f"Show orders on {day:%Y-%m-%d}",
+        "orders_by_date_range": f"Show orders between {day:%Y-%m-%d} and {week_later:%Y-%m-%d}",
+    }
+
+
+def bench_structured(structured_queries, iterations):
+    structured_queries.prepare_indexes()
+    results = {}
+    for expected, question in structured_questions(structured_queries.db).items():
+        intent, entity = structured_queries.detect_intent(question)
+        if intent != expected:
+            results[expected] = {"error": f"question routed to {intent!r}"}
+            continue
+        answer = structured_queries.handle_structured_query(intent, entity)
+        if answer.startswith(MISS_PREFIXES):
+            print(f"⚠️ {intent}: {answer}")
+            results[intent] = {"error": f"no match: {answer}"}
+            continue
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            structured_queries.handle_structured_query(intent, entity)
+            samples.append(time.perf_counter() - started)
+        results[intent] = latency_summary(samples)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline chatbot benchmarks.")
+    parser.add_argument("--products", type=int, default=10000,
+                        help="synthetic products (and orders); users/customers are a tenth of that")
+    parser.add_argument("--suites", nargs="+", default=["ingest", "chat", "structured"],
+                        choices=["ingest", "chat", "structured"])
+    parser.add_argument("--requests", type=int, default=200, help="chat requests to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="chat requests in flight")
+    parser.add_argument("--iterations", type=int, default=50, help="runs per structured intent")
+    parser.add_argument("--ingest-workers", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="seconds per fake embedding call")
+    parser.add_argument("--mongo-uri", help="use this MongoDB server instead of mongomock")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args(argv)
+
+    vector_dir, backend = _configure(args)
+    try:
+        from benchmarks.data import seed
+        from benchmarks.fakes import fake_embeddings, fake_llm
+        import mongo
+
+        print(f"🌱 Seeding {args.products} products into {backend}")
+        counts = seed(mongo.db, products=args.products)
+        embeddings = fake_embeddings(latency=args.embed_latency)
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "backend": backend,
+                "args": vars(args),
+            },
+            "seed": counts,
+        }
+
+        # Chat needs the indexes, so ingestion always runs; it is only reported when asked for
+        import ingest
+        _install_fakes(ingest, embeddings=embeddings)
+        print("📥 Benchmarking ingestion")
+        ingest_results = bench_ingest(ingest, mongo.source_collections(), args.ingest_workers)
+        if "ingest" in args.suites:
+            results["ingest"] = ingest_results
+
+        if "chat" in args.suites:
+            import chatbot
+            _install_fakes(chatbot, embeddings=embeddings, llm=fake_llm(latency=args.llm_latency))
+            chatbot.registry.embeddings = embeddings
+            print(f"💬 Benchmarking {args.requests} chat requests at concurrency {args.concurrency}")
+            results["chat"] = bench_chat(chatbot, args.requests, args.concurrency)
+            chatbot.registry.stop_watcher()
+
+        if "structured" in args.suites:
+            import structured_queries
+            print("🔎 Benchmarking structured queries")
+            results["structured"] = bench_structured(structured_queries, args.iterations)
+    finally:
+        shutil.rmtree(vector_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"✅ Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
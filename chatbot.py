@@ -1,118 +1,635 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
+from langchain.docstore.document import Document
 from langchain.prompts import PromptTemplate
-from langchain_mongodb.chat_message_histories import MongoDBChatMessageHistory
+from langchain_core.prompts import format_document
 from dotenv import load_dotenv
 from langdetect import detect
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
 import os
-from structured_queries import detect_intent, handle_structured_query
-from pymongo import MongoClient
+import threading
+import time
+from structured_queries import answer_structured_query
+from mongo import ANSWER_CACHE_COLLECTION, CHAT_HISTORY_COLLECTION, db, source_collections
+from vector_registry import VectorStoreRegistry
+from cache import LRUTTLCache
+from answer_cache import AnswerCache, make_key
+from session_memory import SessionMemory, estimate_tokens
+from context_assembly import assemble_context
+from doc_store import StaleStoreError
+from metrics import observe, span
 
 load_dotenv()
-MONGODB_URI = os.getenv("MONGODB_URI")
+logger = logging.getLogger(__name__)
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 # Initialize Gemini model
 llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0)
 
-# --- MongoDB Client ---
-client = MongoClient(MONGODB_URI)
-db = client["pet-store-samyotech-in"]
+# "stuff" chain; its prompt and document formatting build the messages sent to Gemini
+qa_chain = load_qa_chain(llm, chain_type="stuff")
+
+# Candidates fetched per collection, and how many survive the global rerank
+PER_COLLECTION_K = int(os.getenv("RAG_PER_COLLECTION_K", "3"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
+
+# Context assembly: token budget for the stuffed documents, relevance cut-offs
+# (absolute L2 distance, and ratio to the best hit), near-duplicate threshold,
+# MMR relevance/diversity trade-off, and the per-field character limit.
+RAG_CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "1500"))
+RAG_MAX_DISTANCE = float(os.getenv("RAG_MAX_DISTANCE")) if os.getenv("RAG_MAX_DISTANCE") else None
+RAG_DISTANCE_RATIO = float(os.getenv("RAG_DISTANCE_RATIO", "1.5"))
+RAG_DEDUP_SIMILARITY = float(os.getenv("RAG_DEDUP_SIMILARITY", "0.9"))
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+RAG_FIELD_CHARS = int(os.getenv("RAG_FIELD_CHARS", "200"))
+
+# "auto" searches the unified index when ingest.py built one; "per_collection" never does
+RETRIEVAL_INDEX = os.getenv("RETRIEVAL_INDEX", "auto")
+UNIFIED_CANDIDATES = int(os.getenv("UNIFIED_CANDIDATES", "12"))
+
+# "concurrent" searches collections in parallel, "sequential" one after another.
+# A collection slower than its timeout is dropped; the deadline bounds the whole fan-out.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "concurrent")
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+RETRIEVAL_COLLECTION_TIMEOUT = float(os.getenv("RETRIEVAL_COLLECTION_TIMEOUT", "2"))
+RETRIEVAL_DEADLINE = float(os.getenv("RETRIEVAL_DEADLINE", "5"))
+
+# Query embeddings are reused across requests; users repeat the same questions
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600"))
+
+# RAG answers are cached per normalized question and data version; re-ingestion or
+# source changes produce a new version, so stale answers are never served.
+# Structured answers are read live from MongoDB and never cached.
+# ANSWER_CACHE_BACKEND: "memory", "disk" (SQLite file) or "mongo" (shared by all workers)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory")
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.db")
+# How long the source-collection version stamp is reused before re-checking MongoDB
+SOURCE_VERSION_TTL = float(os.getenv("SOURCE_VERSION_TTL", "30"))
+
+# Conversation memory per session_id: the last SESSION_MAX_TURNS turns verbatim,
+# older ones as short summary lines, the whole history capped at
+# SESSION_HISTORY_TOKENS. Idle sessions leave memory after SESSION_TTL seconds.
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "1000"))
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "1200"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+# 0 writes each turn before the response returns, so any worker can serve the
+# next one; a positive value batches writes behind and needs a single worker
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "0"))
+# Also put the session's previous question into the retrieval query (helps
+# follow-ups like "and its price?", but can drag in the previous topic)
+SESSION_RETRIEVAL_CONTEXT = os.getenv("SESSION_RETRIEVAL_CONTEXT", "0") == "1"
+
+# Gemini calls in flight per worker. Further requests queue for up to
+# LLM_QUEUE_TIMEOUT seconds (at most LLM_MAX_QUEUE of them) and are then
+# rejected so the API can answer 429 instead of piling up threads.
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "vector_store")
+VECTOR_STORE_REFRESH_SECONDS = float(os.getenv("VECTOR_STORE_REFRESH_SECONDS", "30"))
+
+# Shared embedding client, reused by every resident vector store
+embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+
+
+# --- LLM admission control ---
+class ServerBusy(Exception):
+    """Every LLM slot is taken and the wait queue is full, or the wait timed out."""
+
+
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_INFLIGHT)
+_llm_queue_lock = threading.Lock()
+_llm_waiting = 0
+_llm_rejected = 0
+
+
+@contextmanager
+def llm_slot():
+    """Hold one of LLM_MAX_INFLIGHT slots for the duration of a Gemini call."""
+    global _llm_waiting, _llm_rejected
+    acquired = _llm_slots.acquire(blocking=False)
+    if not acquired:
+        with _llm_queue_lock:
+            if _llm_waiting >= LLM_MAX_QUEUE:
+                _llm_rejected += 1
+                raise ServerBusy("Too many requests are waiting for the LLM")
+            _llm_waiting += 1
+        waited_from = time.perf_counter()
+        try:
+            acquired = _llm_slots.acquire(timeout=LLM_QUEUE_TIMEOUT)
+        finally:
+            observe("llm_queue_wait", time.perf_counter() - waited_from)
+            with _llm_queue_lock:
+                _llm_waiting -= 1
+    if not acquired:
+        with _llm_queue_lock:
+            _llm_rejected += 1
+        raise ServerBusy("Timed out waiting for the LLM")
+    try:
+        yield
+    finally:
+        _llm_slots.release()
+
+
+def llm_stats():
+    return {
+        "max_inflight": LLM_MAX_INFLIGHT,
+        "max_queue": LLM_MAX_QUEUE,
+        "waiting": _llm_waiting,
+        "rejected": _llm_rejected,
+    }
+
+
+# --- Resident vector stores (loaded once, hot-swapped on change) ---
+registry = VectorStoreRegistry(VECTOR_STORE_DIR, embeddings)
+
+
+def start_vector_registry(watch=True):
+    registry.collections = set(source_collections())
+    registry.load_all()
+    if watch:
+        start_vector_watcher()
+
+
+def start_vector_watcher():
+    # Only in processes that serve requests: the gunicorn master never searches
+    registry.start_watcher(VECTOR_STORE_REFRESH_SECONDS)
+
+
+def vector_store_stats():
+    return registry.stats()
+
+
+# --- Query embedding (one remote call per distinct question) ---
+query_embedding_cache = LRUTTLCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE, ttl=QUERY_EMBEDDING_CACHE_TTL)
+
+
+def normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+def embed_query(question):
+    key = normalize_question(question)
+    vector = query_embedding_cache.get(key)
+    if vector is None:
+        with span("query_embedding"):
+            vector = embeddings.embed_query(key)
+        query_embedding_cache.set(key, vector)
+    return vector
+
+
+def query_embedding_cache_stats():
+    return query_embedding_cache.stats()
 
 
 # --- RAG Functions (as before) ---
-def load_vector_stores_and_retrievers():
-    client = MongoClient(MONGODB_URI)
-    db = client["pet-store-samyotech-in"]
+def get_vector_stores():
+    with span("index_load"):
+        registry.ensure_loaded()
+    return registry.stores()
+
+# --- Retrieval timing per collection ---
+retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+_retrieval_stats = {}
+_retrieval_stats_lock = threading.Lock()
+
+
+def record_retrieval(collection_name, seconds, outcome="ok"):
+    with _retrieval_stats_lock:
+        entry = _retrieval_stats.setdefault(collection_name, {
+            "calls": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+            "last_seconds": 0.0, "timeouts": 0, "errors": 0,
+        })
+        entry["calls"] += 1
+        if outcome == "timeout":
+            entry["timeouts"] += 1
+        elif outcome == "error":
+            entry["errors"] += 1
+        if seconds is not None:
+            observe(f"retrieval.{collection_name}", seconds)
+            entry["total_seconds"] += seconds
+            entry["last_seconds"] = seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+
+def retrieval_stats():
+    with _retrieval_stats_lock:
+        return {
+            name: {
+                **entry,
+                "avg_seconds": round(entry["total_seconds"] / entry["calls"], 4) if entry["calls"] else 0.0,
+            }
+            for name, entry in _retrieval_stats.items()
+        }
 
-    # Get all valid collections to query
-    collections_to_query = [
-        col for col in db.list_collection_names()
-        if col != "chat_history"
-        and not col.startswith("system.")
-        and not col.endswith("_embeddings")
-    ]
 
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+def search_collection(collection_name, vs, query_vector, k):
+    hits = []
+    try:
+        results = vs.similarity_search_with_score_by_vector(query_vector, k=k)
+    except StaleStoreError:
+        # Forked before ingest replaced this store; have the watcher reload it
+        registry.refresh_soon()
+        raise
+    for doc, score in results:
+        # Copy so the resident docstore objects are never mutated
+        doc = Document(
+            page_content=doc.page_content,
+            metadata={**doc.metadata, "collection": collection_name, "score": float(score)},
+        )
+        hits.append((float(score), doc))
+    return hits
 
-    vector_stores = {}
 
-    for collection in collections_to_query:
-        dir_path = f"vector_store/{collection}_faiss_index"
-        index_file = os.path.join(dir_path, "index.faiss")
+def _timed_search(collection_name, vs, query_vector, k, started_at):
+    started_at[collection_name] = time.perf_counter()
+    hits = search_collection(collection_name, vs, query_vector, k)
+    return hits, time.perf_counter() - started_at[collection_name]
 
-        if not os.path.exists(index_file):
-            print(f"⚠️ FAISS index not found for collection: {collection}")
-            continue
 
+def _search_sequential(stores, query_vector, k):
+    scored_docs = []
+    for collection_name, vs in stores.items():
+        started = time.perf_counter()
         try:
-            vector_stores[collection] = FAISS.load_local(
-                dir_path,
-                embeddings,
-                allow_dangerous_deserialization=True
-            )
-            print(f"✅ Loaded FAISS index for collection: {collection}")
+            scored_docs.extend(search_collection(collection_name, vs, query_vector, k))
+            record_retrieval(collection_name, time.perf_counter() - started)
         except Exception as e:
-            print(f"❌ Could not load FAISS index for '{collection}': {e}")
+            record_retrieval(collection_name, time.perf_counter() - started, "error")
+            print(f"❌ Error retrieving from {collection_name}: {e}")
+    return scored_docs
 
-    retrievers = {
-        name: vs.as_retriever(search_kwargs={"k": 3})
-        for name, vs in vector_stores.items()
+
+def _search_concurrent(stores, query_vector, k):
+    """Fan out to every store and keep whatever answered in time."""
+    deadline = time.perf_counter() + RETRIEVAL_DEADLINE
+    started_at = {}
+    futures = {
+        retrieval_pool.submit(_timed_search, name, vs, query_vector, k, started_at): name
+        for name, vs in stores.items()
     }
+    pending = set(futures)
+    scored_docs = []
+    while pending:
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        # Abandon collections that have run past their own timeout
+        wake_at = deadline
+        for future in list(pending):
+            started = started_at.get(futures[future])
+            if started is None:
+                # Still queued; check again once it could have timed out
+                wake_at = min(wake_at, now + RETRIEVAL_COLLECTION_TIMEOUT)
+                continue
+            if now - started > RETRIEVAL_COLLECTION_TIMEOUT:
+                pending.discard(future)
+                record_retrieval(futures[future], now - started, "timeout")
+                print(f"⏱️ Retrieval from {futures[future]} timed out")
+            else:
+                wake_at = min(wake_at, started + RETRIEVAL_COLLECTION_TIMEOUT)
+        if not pending:
+            break
+
+        done, pending = wait(pending, timeout=max(wake_at - now, 0.001), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            try:
+                hits, elapsed = future.result()
+            except Exception as e:
+                record_retrieval(name, None, "error")
+                print(f"❌ Error retrieving from {name}: {e}")
+                continue
+            if elapsed > RETRIEVAL_COLLECTION_TIMEOUT:
+                record_retrieval(name, elapsed, "timeout")
+                continue
+            record_retrieval(name, elapsed)
+            scored_docs.extend(hits)
 
-    print(f"🎯 Total retrievers loaded: {len(retrievers)}")
+    # Past the global deadline: drop the stragglers and answer with what we have
+    for future in pending:
+        future.cancel()
+        record_retrieval(futures[future], None, "timeout")
+        print(f"⏱️ Retrieval from {futures[future]} missed the deadline")
+    return scored_docs
 
-    return retrievers
 
-def aggregate_context(question, retrievers):
-    all_docs = []
-    for collection_name, retriever in retrievers.items():
+def aggregate_context(question, vector_stores, k=PER_COLLECTION_K, collections=None):
+    """Search every collection and return ``(score, doc)`` pairs (lower score = closer).
+
+    ``k`` caps the hits per collection; ``collections`` optionally restricts the search.
+    """
+    # Embed once and fan the same vector out to every store
+    query_vector = embed_query(question)
+    if collections is None:
+        collections = registry.collections
+
+    unified = registry.unified() if RETRIEVAL_INDEX != "per_collection" else None
+    if unified is not None:
+        started = time.perf_counter()
         try:
-            docs = retriever.get_relevant_documents(question)
-            for doc in docs:
-                # Optionally add metadata so we know where it came from
-                doc.metadata["collection"] = collection_name
-                all_docs.append(doc)
+            # One search over all collections, at most k hits from each
+            hits = unified.search(query_vector, UNIFIED_CANDIDATES, collections=collections, default_quota=k)
+            record_retrieval("unified", time.perf_counter() - started)
+            return hits
         except Exception as e:
-            print(f"❌ Error retrieving from {collection_name}: {e}")
-    return all_docs
+            record_retrieval("unified", time.perf_counter() - started, "error")
+            if isinstance(e, StaleStoreError):
+                registry.refresh_soon()
+            print(f"❌ Unified index search failed, falling back to per-collection search: {e}")
 
-def run_rag_chain(question, docs):
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+    stores = {
+        name: vs for name, vs in vector_stores.items()
+        if collections is None or name in collections
+    }
+    if RETRIEVAL_MODE == "sequential":
+        return _search_sequential(stores, query_vector, k)
+    return _search_concurrent(stores, query_vector, k)
+
+def rerank_documents(scored_docs, k=RAG_TOP_K):
+    # Every index uses the same embedding model and L2 distance, so scores
+    # from different collections are directly comparable.
+    return assemble_context(
+        scored_docs,
+        max_docs=k,
+        max_tokens=RAG_CONTEXT_TOKENS,
+        max_distance=RAG_MAX_DISTANCE,
+        distance_ratio=RAG_DISTANCE_RATIO,
+        dedup_similarity=RAG_DEDUP_SIMILARITY,
+        mmr_lambda=RAG_MMR_LAMBDA,
+        field_chars=RAG_FIELD_CHARS,
+    )
+
+def clean_answer(text):
+    return text.replace('*', '').replace('**', '').replace('\n\n', '\n')
+
+def build_prompt(question, docs):
+    """The exact messages the stuff chain would send for ``docs``."""
+    context = qa_chain.document_separator.join(
+        format_document(doc, qa_chain.document_prompt) for doc in docs
+    )
+    messages = qa_chain.llm_chain.prompt.format_prompt(context=context, question=question).to_messages()
+    logger.info(
+        "RAG prompt: %d documents, ~%d tokens (%d context chars)",
+        len(docs), sum(estimate_tokens(message.content) for message in messages), len(context),
+    )
+    return messages
 
+def retrieve_documents(question, session_id=None):
+    vector_stores = get_vector_stores()
+    if not vector_stores:
+        print("⚠️ No vector stores loaded!")
+    query = question
+    if SESSION_RETRIEVAL_CONTEXT:
+        previous = session_memory.last_question(session_id)
+        if previous:
+            query = f"{previous} {question}"
+    with span("retrieval"):
+        scored_docs = aggregate_context(query, vector_stores)
+        return rerank_documents(scored_docs)
+
+def with_history(question, history):
+    if not history:
+        return question
+    return f"Conversation so far:\n{history}\n\nCurrent question: {question}"
+
+def run_rag_chain(question, docs, history=""):
     if not docs:
         return "No relevant documents found."
 
-    # Build temporary retriever from the relevant docs
-    temp_vectorstore = FAISS.from_documents(docs, embedding=embeddings)
-    retriever = temp_vectorstore.as_retriever()
+    # Same messages the stuff chain would send, built here so prompt and LLM time are measured apart
+    with span("prompt_build"):
+        messages = build_prompt(with_history(question, history), docs)
+    with llm_slot(), span("llm"):
+        result = llm.invoke(messages)
+    answer = clean_answer(result.content)
+    logger.debug("answer %s", answer)
+    return answer
+
+def stream_rag_answer(question, docs, history=""):
+    """Yield the answer in chunks as Gemini produces them."""
+    if not docs:
+        yield "No relevant documents found."
+        return
+    with span("prompt_build"):
+        messages = build_prompt(with_history(question, history), docs)
+    with llm_slot(), span("llm"):
+        started = time.perf_counter()
+        first = True
+        for chunk in llm.stream(messages):
+            if first:
+                observe("llm_first_token", time.perf_counter() - started)
+                first = False
+            text = chunk.content.replace('*', '')
+            if text:
+                yield text
+# --- Conversation memory ---
+session_memory = SessionMemory(
+    lambda: db[CHAT_HISTORY_COLLECTION],
+    max_turns=SESSION_MAX_TURNS,
+    max_tokens=SESSION_HISTORY_TOKENS,
+    summary_max_chars=SESSION_SUMMARY_CHARS,
+    ttl=SESSION_TTL,
+    max_sessions=SESSION_MAX,
+    flush_interval=SESSION_FLUSH_SECONDS,
+)
+
+
+def new_session_id():
+    return session_memory.new_session()
+
+
+def remember(session_id, question, answer):
+    try:
+        session_memory.append(session_id, question, answer)
+    except Exception as e:
+        print(f"❌ Could not record conversation turn: {e}")
+
+
+def session_memory_stats():
+    return session_memory.stats()
 
-    rag_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=retriever,
-        return_source_documents=True,
-    )
 
-    result = rag_chain({"query": question})
-    answer = result["result"].replace('*', '').replace('**', '').replace('\n\n', '\n')
-    print("answer", answer)
+# --- Intent routing (structured questions skip RAG entirely) ---
+_route_counts = Counter()
+_intent_counts = Counter()
+_route_lock = threading.Lock()
+
+
+def record_route(path, intent=None):
+    with _route_lock:
+        _route_counts[path] += 1
+        if intent:
+            _intent_counts[intent] += 1
+
+
+def route_stats():
+    with _route_lock:
+        return {"paths": dict(_route_counts), "intents": dict(_intent_counts)}
+
+
+def route_structured(question, page=1, after=None):
+    """Return a MongoDB-backed answer for structured intents, or None to fall back to RAG.
+
+    ``page``/``after`` select the page of a 'list' answer.
+    """
+    try:
+        with span("routing"):
+            intent, answer = answer_structured_query(question, page, after)
+    except Exception as e:
+        print(f"❌ Structured query failed, falling back to RAG: {e}")
+        return None
+    if answer is None:
+        return None
+    record_route("structured", intent)
     return answer
+
+
+# --- Answer cache ---
+answer_cache = AnswerCache(
+    maxsize=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    backend=ANSWER_CACHE_BACKEND,
+    path=ANSWER_CACHE_PATH,
+    collection=lambda: db[ANSWER_CACHE_COLLECTION],
+)
+_source_version = LRUTTLCache(maxsize=1, ttl=SOURCE_VERSION_TTL)
+
+
+def source_version():
+    """Stamp of the source collections: document count and newest _id of each."""
+    version = _source_version.get("sources")
+    if version is None:
+        parts = []
+        for name in sorted(registry.collections or source_collections()):
+            newest = db[name].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            parts.append((name, db[name].estimated_document_count(), str(newest["_id"]) if newest else None))
+        version = make_key(parts)[:16]
+        _source_version.set("sources", version)
+    return version
+
+
+def answer_cache_key(question, page=1, after=None, session_id=None):
+    # The same question can mean something else mid-conversation, so the history is part of the key
+    return make_key(
+        normalize_question(question), page, after, registry.version(), source_version(),
+        session_memory.fingerprint(session_id),
+    )
+
+
+def answer_cache_stats():
+    return answer_cache.stats()
+
+
 # --- Main Chatbot Entry ---
-def get_response(question, session_id):
+def get_response(question, session_id, page=1, after=None):
+    with span("get_response"):
+        return _get_response(question, session_id, page, after)
+
+
+def _get_response(question, session_id, page=1, after=None):
+    # Structured answers are cheap and an in-place update changes no version stamp, so skip the cache
+    answer = route_structured(question, page, after)
+    if answer is not None:
+        remember(session_id, question, answer)
+        return answer
+
     try:
-        retrievers = load_vector_stores_and_retrievers()
-        print("🔍 Retriever Dictionary Keys & Types:")
-        if not retrievers:
-            print("⚠️ No retrievers loaded!")
-
-        docs = aggregate_context(question, retrievers)
-        answer = run_rag_chain(question, docs)
-        print("answer========>>", answer)
+        key = answer_cache_key(question, page, after, session_id)
+    except Exception as e:
+        print(f"❌ Could not compute answer cache key: {e}")
+        key = None
+    if key is not None:
+        cached = answer_cache.get(key)
+        if cached is not None:
+            record_route("cache")
+            remember(session_id, question, cached)
+            return cached
+
+    answer = compute_response(question, session_id)
+    # Error responses come back as (message, error) tuples and are never cached or remembered
+    if isinstance(answer, str):
+        if key is not None:
+            answer_cache.set(key, answer)
+        remember(session_id, question, answer)
+    return answer
+
+
+def compute_response(question, session_id):
+    """Answer through RAG (retrieval plus the LLM)."""
+    try:
+        record_route("rag")
+
+        docs = retrieve_documents(question, session_id)
+        answer = run_rag_chain(question, docs, session_memory.history(session_id))
+        logger.debug("answer %s", answer)
         return answer
+    except ServerBusy:
+        raise
     except Exception as e:
         print(f"Error in get_response: {e}")
         error_msg = "Mujhe yeh information nahi hai." if 'lang' in locals() and lang == 'hi' else "I don't have this information."
-        return error_msg, str(e)
\ No newline at end of file
+        return error_msg, str(e)
+
+
+def stream_response(question, session_id, page=1, after=None):
+    """Like get_response, but yields ``(event, data)`` pairs for server-sent events.
+
+    A "sources" event goes out as soon as retrieval finishes (before the LLM
+    starts), then one "token" event per chunk and a final "done" with the
+    cleaned full answer.
+    """
+    answer = route_structured(question, page, after)
+    if answer is not None:
+        remember(session_id, question, answer)
+        yield "sources", {"route": "structured", "collections": []}
+        yield "token", {"text": answer}
+        yield "done", {"answer": answer, "next_cursor": getattr(answer, "next_cursor", None)}
+        return
+
+    try:
+        key = answer_cache_key(question, page, after, session_id)
+    except Exception as e:
+        print(f"❌ Could not compute answer cache key: {e}")
+        key = None
+    cached = answer_cache.get(key) if key is not None else None
+    if cached is not None:
+        record_route("cache")
+        remember(session_id, question, cached)
+        yield "sources", {"route": "cache", "collections": []}
+        yield "token", {"text": cached}
+        yield "done", {"answer": cached}
+        return
+
+    try:
+        record_route("rag")
+        docs = retrieve_documents(question, session_id)
+        collections = list(dict.fromkeys(doc.metadata.get("collection") for doc in docs))
+        yield "sources", {"route": "rag", "collections": collections, "documents": len(docs)}
+        parts = []
+        for text in stream_rag_answer(question, docs, session_memory.history(session_id)):
+            parts.append(text)
+            yield "token", {"text": text}
+        answer = clean_answer("".join(parts))
+    except ServerBusy as e:
+        yield "error", {"error": str(e), "busy": True}
+        return
+    except Exception as e:
+        print(f"Error in stream_response: {e}")
+        yield "error", {"error": str(e), "answer": "I don't have this information."}
+        return
+
+    if key is not None:
+        answer_cache.set(key, answer)
+    remember(session_id, question, answer)
+    yield "done", {"answer": answer}
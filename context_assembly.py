@@ -0,0 +1,94 @@
+import re
+
+from langchain.docstore.document import Document
+
+from session_memory import estimate_tokens
+
+# Fields that never help answer a question and should not reach the prompt
+SKIP_FIELD_PATTERN = re.compile(r"password|token|secret|otp|^__v$", re.IGNORECASE)
+_WORD = re.compile(r"\w+")
+
+
+def _words(text):
+    return frozenset(_WORD.findall(text.lower()))
+
+
+def similarity(a, b):
+    """Jaccard overlap of two word sets (1.0 = same words)."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def trim_document(doc, field_chars=200):
+    """Rewrite ``page_content`` as labelled, clipped fields from the source record.
+
+    Ingestion joins every field value with spaces; the prompt gets
+    ``field: value`` pairs instead, without empty or sensitive fields and with
+    long values (descriptions, nested objects) cut to ``field_chars``.
+    """
+    fields = doc.metadata.get("original_fields")
+    if not fields:
+        return doc
+    parts = []
+    for name, value in fields.items():
+        if value in (None, "", [], {}) or SKIP_FIELD_PATTERN.search(name):
+            continue
+        text = " ".join(str(value).split())
+        if len(text) > field_chars:
+            text = text[:field_chars - 1] + "…"
+        parts.append(f"{name}: {text}")
+    if not parts:
+        return doc
+    collection = doc.metadata.get("collection") or doc.metadata.get("source_collection")
+    content = "; ".join(parts)
+    return Document(page_content=f"[{collection}] {content}" if collection else content, metadata=doc.metadata)
+
+
+def assemble_context(scored_docs, max_docs=4, max_tokens=1500, max_distance=None, distance_ratio=1.5,
+                     dedup_similarity=0.9, mmr_lambda=0.7, field_chars=200):
+    """Choose which ``(score, doc)`` candidates go into the prompt (lower score = closer).
+
+    Candidates from every collection are ranked together. Anything farther
+    than ``max_distance``, or more than ``distance_ratio`` times the best
+    distance, is dropped as irrelevant. The rest are picked by maximal
+    marginal relevance (``mmr_lambda`` trades relevance against overlap with
+    what is already picked), near-duplicates are skipped, and documents are
+    packed until ``max_docs`` or ``max_tokens`` is reached.
+    """
+    candidates = sorted(scored_docs, key=lambda item: item[0])
+    if not candidates:
+        return []
+    best = candidates[0][0]
+    kept = []
+    for score, doc in candidates:
+        if max_distance is not None and score > max_distance:
+            break
+        if distance_ratio and best > 0 and score > best * distance_ratio:
+            break
+        doc = trim_document(doc, field_chars)
+        kept.append((score, doc, _words(doc.page_content)))
+    if not kept:
+        return []
+
+    # Distances normalized to 0..1 relevance (1 = best candidate)
+    spread = kept[-1][0] - best
+    relevance = [1.0 if spread <= 0 else 1.0 - (score - best) / spread for score, _, _ in kept]
+
+    selected, budget = [], max_tokens
+    remaining = list(range(len(kept)))
+    while remaining and len(selected) < max_docs and budget > 0:
+        redundancy = {
+            i: max((similarity(kept[i][2], kept[j][2]) for j in selected), default=0.0)
+            for i in remaining
+        }
+        pick = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy[i])
+        remaining.remove(pick)
+        if redundancy[pick] >= dedup_similarity:
+            continue
+        cost = estimate_tokens(kept[pick][1].page_content)
+        if cost > budget:
+            continue
+        selected.append(pick)
+        budget -= cost
+    return [kept[i][1] for i in selected]
@@ -0,0 +1,386 @@
+"""Compact on-disk vector stores: memory-mapped vectors plus a SQLite document table.
+
+A store directory holds ``vectors.f32`` (raw float32 rows), ``norms.f32``
+(squared row norms), ``docs.sqlite`` (text and JSON metadata per row,
+read only for the rows a search returns) and ``meta.json``. Nothing is
+unpickled on load, and the vectors are paged in by the OS on demand and
+shared between worker processes.
+
+Convert the older pickled LangChain FAISS directories in place with
+``python doc_store.py convert vector_store``.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+from langchain.docstore.document import Document
+
+COMPACT_FORMAT = "compact-v1"
+# Vectors and documents first: the registry reports their sizes from the signature
+COMPACT_FILES = ("vectors.f32", "docs.sqlite", "norms.f32", "meta.json")
+LEGACY_FILES = ("index.faiss", "index.pkl")
+
+# Pickled FAISS indexes are refused at load time; convert them with ingest.py or
+# "convert" (which unpickles them once, explicitly). Set to 1 to read them as they are.
+ALLOW_PICKLE_INDEXES = os.getenv("ALLOW_PICKLE_INDEXES", "0") == "1"
+
+DOCS_SCHEMA = (
+    "CREATE TABLE docs ("
+    "position INTEGER PRIMARY KEY, source_id TEXT, content_hash TEXT, "
+    "page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+)
+# SQLite's default limit on bound parameters per statement is 999
+_SQL_BATCH = 900
+
+
+class StaleStoreError(RuntimeError):
+    """The document table on disk belongs to a newer store than the vectors in memory."""
+
+
+# --- Document table ---
+def new_generation():
+    return uuid.uuid4().hex
+
+
+def create_doc_table(path, generation):
+    """New table tagged with ``generation``, the id also written to the store's meta.json."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(DOCS_SCHEMA)
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT INTO meta VALUES ('generation', ?)", (generation,))
+    return conn
+
+
+def insert_docs(conn, start, texts, metadatas):
+    conn.executemany(
+        "INSERT INTO docs VALUES (?, ?, ?, ?, ?)",
+        [
+            (start + i, metadata.get("source_id"), metadata.get("content_hash"), text,
+             json.dumps(metadata, default=str))
+            for i, (text, metadata) in enumerate(zip(texts, metadatas))
+        ],
+    )
+
+
+def finish_doc_table(conn):
+    conn.execute("CREATE INDEX docs_source_id ON docs (source_id)")
+    conn.commit()
+    conn.close()
+
+
+class DocTable:
+    """Read-only view of ``docs.sqlite``; rows are fetched by vector position.
+
+    ``generation`` is the id from the store's meta.json. Every (re)open checks
+    the table carries the same id, so a worker forked before the directory
+    was replaced never pairs old vectors with new documents.
+    """
+
+    def __init__(self, path, generation=None):
+        self.path = path
+        self.generation = generation
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        # Open now so the file stays readable even after a newer store replaces it
+        self._connection()
+
+    def _connection(self):
+        # SQLite connections must not cross fork(); each worker opens its own
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            if self.generation is not None:
+                try:
+                    row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+                except sqlite3.Error:
+                    row = None
+                if row is None or row[0] != self.generation:
+                    conn.close()
+                    self._conn = None
+                    raise StaleStoreError(f"{self.path} was replaced by a newer store")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def get(self, positions):
+        """``(page_content, metadata)`` for each position, in the order given."""
+        found = {}
+        for i in range(0, len(positions), _SQL_BATCH):
+            chunk = positions[i:i + _SQL_BATCH]
+            rows = self._query(
+                f"SELECT position, page_content, metadata FROM docs WHERE position IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for position, text, metadata in rows:
+                found[position] = (text, json.loads(metadata))
+        return [found[p] for p in positions]
+
+    def raw_rows(self, positions):
+        """Rows exactly as stored, for copying into a new table without re-serializing."""
+        rows = []
+        for i in range(0, len(positions), _SQL_BATCH):
+            chunk = positions[i:i + _SQL_BATCH]
+            rows.extend(self._query(
+                "SELECT position, source_id, content_hash, page_content, metadata FROM docs "
+                f"WHERE position IN ({','.join('?' * len(chunk))}) ORDER BY position",
+                chunk,
+            ))
+        return rows
+
+    def iter_all(self, batch_size=1000):
+        last = -1
+        while True:
+            rows = self._query(
+                "SELECT position, page_content, metadata FROM docs WHERE position > ? ORDER BY position LIMIT ?",
+                (last, batch_size),
+            )
+            if not rows:
+                return
+            for position, text, metadata in rows:
+                yield text, json.loads(metadata)
+            last = rows[-1][0]
+
+    def source_index(self):
+        """``{source_id: (position, content_hash)}`` without loading any text."""
+        rows = self._query("SELECT source_id, position, content_hash FROM docs WHERE source_id IS NOT NULL")
+        return {source_id: (position, content_hash) for source_id, position, content_hash in rows}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+class DocList(list):
+    """In-memory ``(page_content, metadata)`` rows with the DocTable ``get`` interface."""
+
+    def get(self, positions):
+        return [self[p] for p in positions]
+
+
+# --- Store ---
+class CompactStoreWriter:
+    """Streams vectors and documents into a new store directory, batch by batch."""
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        shutil.rmtree(dir_path, ignore_errors=True)
+        os.makedirs(dir_path)
+        self._vectors = open(os.path.join(dir_path, "vectors.f32"), "wb")
+        self._norms = open(os.path.join(dir_path, "norms.f32"), "wb")
+        self.generation = new_generation()
+        self._docs = create_doc_table(os.path.join(dir_path, "docs.sqlite"), self.generation)
+        self.count = 0
+        self.dimension = None
+
+    def _write_vectors(self, vectors):
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("vectors must be a 2-D array")
+        if self.dimension is None:
+            self.dimension = matrix.shape[1]
+        elif matrix.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {matrix.shape[1]}")
+        self._vectors.write(matrix.tobytes())
+        self._norms.write(np.einsum("ij,ij->i", matrix, matrix).astype(np.float32).tobytes())
+        return len(matrix)
+
+    def add(self, texts, metadatas, vectors):
+        if not texts:
+            return
+        n = self._write_vectors(vectors)
+        insert_docs(self._docs, self.count, texts, metadatas)
+        self.count += n
+
+    def copy_from(self, store, positions):
+        """Append rows of an existing :class:`CompactStore` as they are (no re-embedding)."""
+        positions = sorted(positions)
+        for i in range(0, len(positions), _SQL_BATCH):
+            chunk = positions[i:i + _SQL_BATCH]
+            self._write_vectors(store.vectors[chunk])
+            self._docs.executemany(
+                "INSERT INTO docs VALUES (?, ?, ?, ?, ?)",
+                [(self.count + j, *row[1:]) for j, row in enumerate(store.docs.raw_rows(chunk))],
+            )
+            self.count += len(chunk)
+
+    def close(self):
+        self._vectors.close()
+        self._norms.close()
+        finish_doc_table(self._docs)
+        with open(os.path.join(self.dir_path, "meta.json"), "w") as f:
+            json.dump({
+                "format": COMPACT_FORMAT,
+                "count": self.count,
+                "dimension": self.dimension,
+                "generation": self.generation,
+                "created_at": time.time(),
+            }, f)
+
+    def abort(self):
+        for handle in (self._vectors, self._norms, self._docs):
+            try:
+                handle.close()
+            except Exception:
+                pass
+        shutil.rmtree(self.dir_path, ignore_errors=True)
+
+
+class CompactStore:
+    """Exact L2 search over memory-mapped vectors, with documents read on demand.
+
+    Offers the ``similarity_search_with_score_by_vector`` call the chatbot
+    uses on LangChain's FAISS store, with the same squared-L2 scores.
+    """
+
+    def __init__(self, dir_path):
+        with open(os.path.join(dir_path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("format") != COMPACT_FORMAT:
+            raise ValueError(f"Unsupported store format {meta.get('format')!r} in {dir_path}")
+        self.dir_path = dir_path
+        self.dimension = meta["dimension"] or 0
+        count = meta["count"]
+        if count:
+            self.vectors = np.memmap(os.path.join(dir_path, "vectors.f32"), dtype=np.float32,
+                                     mode="r", shape=(count, self.dimension))
+        else:
+            self.vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        # 4 bytes per vector; read fully so each search only touches the vector pages
+        self.norms = np.fromfile(os.path.join(dir_path, "norms.f32"), dtype=np.float32)
+        self.docs = DocTable(os.path.join(dir_path, "docs.sqlite"), meta.get("generation"))
+
+    @property
+    def ntotal(self):
+        return len(self.vectors)
+
+    def search(self, query_vector, k):
+        """``(distances, positions)`` of the ``k`` nearest rows, closest first."""
+        if self.ntotal == 0 or k <= 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        query = np.asarray(query_vector, dtype=np.float32)
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2
+        distances = self.norms - 2.0 * (self.vectors @ query) + float(query @ query)
+        k = min(k, self.ntotal)
+        positions = np.argpartition(distances, k - 1)[:k]
+        positions = positions[np.argsort(distances[positions])]
+        return np.maximum(distances[positions], 0.0), positions
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        distances, positions = self.search(embedding, k)
+        rows = self.docs.get(positions.tolist())
+        return [
+            (Document(page_content=text, metadata=metadata), float(distance))
+            for (text, metadata), distance in zip(rows, distances.tolist())
+        ]
+
+    def close(self):
+        self.docs.close()
+
+
+# --- Directories ---
+def is_compact(dir_path):
+    return os.path.exists(os.path.join(dir_path, "meta.json")) and os.path.exists(
+        os.path.join(dir_path, "vectors.f32")
+    )
+
+
+def has_store(dir_path):
+    return is_compact(dir_path) or os.path.exists(os.path.join(dir_path, "index.faiss"))
+
+
+def store_files(dir_path):
+    return COMPACT_FILES if is_compact(dir_path) else LEGACY_FILES
+
+
+def load_legacy(dir_path, embeddings=None):
+    if not ALLOW_PICKLE_INDEXES:
+        raise ValueError(
+            f"{dir_path} is a pickled FAISS index; convert it with 'python doc_store.py convert' "
+            "or set ALLOW_PICKLE_INDEXES=1"
+        )
+    print(f"⚠️ {dir_path} is in the old pickled format; run ingest.py or 'python doc_store.py convert' to convert it")
+    return _unpickle_legacy(dir_path, embeddings)
+
+
+def _unpickle_legacy(dir_path, embeddings=None):
+    from langchain_community.vectorstores import FAISS
+    return FAISS.load_local(dir_path, embeddings, allow_dangerous_deserialization=True)
+
+
+def load_store(dir_path, embeddings=None):
+    """A :class:`CompactStore`, or LangChain FAISS for a directory not yet converted."""
+    if is_compact(dir_path):
+        return CompactStore(dir_path)
+    return load_legacy(dir_path, embeddings)
+
+
+def store_contents(store):
+    """``(vectors, rows)`` of either store kind; rows are ``(page_content, metadata)``."""
+    if isinstance(store, CompactStore):
+        return np.asarray(store.vectors), store.docs.iter_all()
+    n = store.index.ntotal
+    rows = []
+    for i in range(n):
+        doc = store.docstore.search(store.index_to_docstore_id[i])
+        rows.append((doc.page_content, doc.metadata))
+    return store.index.reconstruct_n(0, n), rows
+
+
+def replace_dir(tmp_dir, dir_path):
+    """Swap a fully written ``tmp_dir`` in for ``dir_path`` so readers never see a partial store."""
+    old_dir = f"{dir_path}.old-{os.getpid()}-{threading.get_ident()}"
+    if os.path.exists(dir_path):
+        os.rename(dir_path, old_dir)
+    os.rename(tmp_dir, dir_path)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def convert_legacy(dir_path):
+    """Rewrite one pickled FAISS directory in the compact format; returns the row count.
+
+    Running the conversion is the opt-in to unpickling it this one time.
+    """
+    store = _unpickle_legacy(dir_path)
+    vectors, rows = store_contents(store)
+    tmp_dir = f"{dir_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    writer = CompactStoreWriter(tmp_dir)
+    try:
+        writer.add([text for text, _ in rows], [metadata for _, metadata in rows], vectors)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    replace_dir(tmp_dir, dir_path)
+    return writer.count
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2 or argv[0] != "convert":
+        print("usage: python doc_store.py convert <vector_store dir>")
+        return 2
+    base_dir = argv[1]
+    for entry in sorted(os.listdir(base_dir)):
+        dir_path = os.path.join(base_dir, entry)
+        if not entry.endswith("_faiss_index") or is_compact(dir_path) or not has_store(dir_path):
+            continue
+        print(f"✅ Converted {entry}: {convert_legacy(dir_path)} documents")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+import os
+
+# Production server: gunicorn -c gunicorn.conf.py wsgi:app
+bind = f"0.0.0.0:{os.getenv('PORT', '4000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# Threads per worker; requests mostly wait on Gemini and MongoDB
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Streaming answers keep a connection open for the whole generation
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Import the app (and load the vector indexes) once in the master; workers
+# share those pages copy-on-write instead of each loading from disk
+preload_app = True
+
+
+def post_fork(server, worker):
+    # The master only loads the indexes; each worker runs its own index watcher.
+    # MongoClient is recreated lazily per process by mongo.get_client().
+    from chatbot import start_vector_watcher
+    start_vector_watcher()
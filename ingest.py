@@ -1,18 +1,47 @@
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain.docstore.document import Document
 from dotenv import load_dotenv
+from doc_store import CompactStore, CompactStoreWriter, has_store, is_compact, replace_dir
+from unified_index import UNIFIED_DIR_NAME, build_unified_index
+from mongo import db, source_collections
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import hashlib
+import json
 import os
+import queue
+import random
+import resource
+import shutil
+import sys
+import threading
+import time
 
 # Load environment variables
 load_dotenv()
-MONGODB_URI = os.getenv("MONGODB_URI")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
-# Initialize MongoDB client
-client = MongoClient(MONGODB_URI)
-db = client["pet-store-samyotech-in"]
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "vector_store")
+
+# Defaults for --full (re-embed everything) and --unified (also build the merged index)
+FULL_REBUILD = os.getenv("INGEST_FULL_REBUILD") == "1"
+BUILD_UNIFIED_INDEX = os.getenv("BUILD_UNIFIED_INDEX") == "1"
+
+# Documents read from the cursor, embedded and upserted together; also the
+# bulk_write size for <collection>_embeddings
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+# Batches read ahead of the embedder; with BATCH_SIZE this bounds memory per collection
+BUFFER_BATCHES = int(os.getenv("INGEST_BUFFER_BATCHES", "2"))
+
+# Embedding requests: texts per call, calls in flight, retries with exponential backoff
+EMBED_CHUNK_SIZE = int(os.getenv("INGEST_EMBED_CHUNK_SIZE", "100"))
+EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("INGEST_EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_SECONDS = float(os.getenv("INGEST_EMBED_BACKOFF_SECONDS", "1"))
+
+# Unfinished --full rebuilds, so a restarted run resumes instead of re-embedding
+CHECKPOINT_DIR = os.path.join(VECTOR_STORE_DIR, ".checkpoints")
 
 # Fields to exclude from embedding
 EXCLUDED_FIELDS = {"_id", "createdAt", "updatedAt", "__v", "isDelete", "image"}
@@ -20,12 +49,297 @@ EXCLUDED_FIELDS = {"_id", "createdAt", "updatedAt", "__v", "isDelete", "image"}
 # Initialize embedding model
 embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
 
-# Get all collections dynamically (exclude system collections, chat_history, and _embeddings collections)
-collections = [col for col in db.list_collection_names() if col != "chat_history" and not col.startswith("system.") and not col.endswith("_embeddings")]
+# Caps embedding calls in flight across the whole process
+embed_semaphore = threading.BoundedSemaphore(EMBED_CONCURRENCY)
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def to_document(doc, collection_name, field_names):
+    # Concatenate all field values into a single string
+    field_values = []
+    for field_name in field_names:
+        value = doc.get(field_name)
+        if value is not None:
+            field_values.append(str(value))  # Convert to string
+        else:
+            field_values.append("")
+    text = " ".join(field_values)
+    if not text.strip():
+        return None
+
+    return Document(
+        page_content=text,
+        metadata={
+            "source_id": str(doc["_id"]),
+            "source_collection": collection_name,
+            "content_hash": content_hash(text),
+            "original_fields": {field_name: doc.get(field_name) for field_name in field_names}
+        }
+    )
+
+
+def iter_document_batches(source_collection, collection_name, field_names, batch_size=BATCH_SIZE):
+    """Yield lists of at most ``batch_size`` Documents straight off the cursor."""
+    batch = []
+    cursor = source_collection.find(
+        {field_name: {"$exists": True} for field_name in field_names}
+    ).batch_size(batch_size)
+    for doc in cursor:
+        document = to_document(doc, collection_name, field_names)
+        if document is None:
+            continue
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prefetch(batches, maxsize=BUFFER_BATCHES):
+    """Read ``batches`` on a background thread, holding at most ``maxsize`` ready batches.
+
+    Lets the next cursor batch load while the current one is embedded without
+    letting a fast reader run ahead of a slow embedding API.
+    """
+    buffer = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def _put(item):
+        # Never block for good: the consumer may have given up with the buffer full
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        try:
+            for batch in batches:
+                if not _put(batch):
+                    return
+            _put(done)
+        except Exception as e:
+            _put(e)
+        finally:
+            # Closes the MongoDB cursor behind the batches when stopped early
+            close = getattr(batches, "close", None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load_index(dir_path):
+    """Open the existing compact store if it can be updated incrementally, else None.
+
+    Old pickled FAISS indexes are rebuilt once in the compact format; their
+    vectors are reused from MongoDB, so nothing is re-embedded.
+    """
+    if not has_store(dir_path):
+        return None
+    if not is_compact(dir_path):
+        print(f"⚠️ Index at {dir_path} is in the old pickled format, rebuilding it as a compact store")
+        return None
+    try:
+        store = CompactStore(dir_path)
+    except Exception as e:
+        print(f"⚠️ Could not open existing index at {dir_path}, rebuilding: {e}")
+        return None
+    return store
+
+
+def ensure_embeddings_index(target_collection):
+    # One embedding per source document; also makes the upsert filter an index lookup
+    try:
+        target_collection.create_index("metadata.source_id", unique=True)
+    except Exception as e:
+        print(f"⚠️ Could not create unique index on {target_collection.name}.metadata.source_id: {e}")
+
+
+def upsert_embeddings(target_collection, documents, embedding_vectors, batch_size=BATCH_SIZE):
+    """Upsert ``documents`` with their vectors in ``bulk_write`` batches; returns the upsert count."""
+    written = 0
+    operations = []
+    now = time.time()
+    for doc, embedding in zip(documents, embedding_vectors):
+        operations.append(UpdateOne(
+            {"metadata.source_id": doc.metadata["source_id"]},
+            {"$set": {
+                "text": doc.page_content,
+                "metadata": doc.metadata,
+                "embedding": embedding,
+                "embedded_at": now,
+            }},
+            upsert=True,
+        ))
+        if len(operations) >= batch_size:
+            target_collection.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+    if operations:
+        target_collection.bulk_write(operations, ordered=False)
+        written += len(operations)
+    return written
+
+
+def embed_with_retry(texts):
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            with embed_semaphore:
+                return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            # Exponential backoff with jitter so parallel chunks don't retry in lockstep
+            delay = EMBED_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+            print(f"⚠️ Embedding request failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def embed_and_store(target_collection, documents):
+    """Embed ``documents`` chunk by chunk and upsert each chunk as soon as it is embedded.
+
+    Every finished chunk is durable in MongoDB, so a crashed run only loses
+    the chunks that were in flight. Returns ``{source_id: vector}``.
+    """
+    chunks = [documents[i:i + EMBED_CHUNK_SIZE] for i in range(0, len(documents), EMBED_CHUNK_SIZE)]
+    vectors = {}
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        futures = {
+            pool.submit(embed_with_retry, [doc.page_content for doc in chunk]): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            chunk_vectors = future.result()
+            upsert_embeddings(target_collection, chunk, chunk_vectors)
+            for doc, vector in zip(chunk, chunk_vectors):
+                vectors[doc.metadata["source_id"]] = vector
+    return vectors
 
-# Loop through each collection
-for collection_name in collections:
+
+def stored_vectors(target_collection, documents, since=None):
+    """Vectors already in ``<collection>_embeddings`` for the current text of ``documents``.
+
+    With ``since``, only vectors written at or after that time count.
+    """
+    by_id = {doc.metadata["source_id"]: doc for doc in documents}
+    ids = list(by_id)
+    vectors = {}
+    for i in range(0, len(ids), BATCH_SIZE):
+        query = {"metadata.source_id": {"$in": ids[i:i + BATCH_SIZE]}}
+        if since is not None:
+            query["embedded_at"] = {"$gte": since}
+        for d in target_collection.find(query, {"metadata.source_id": 1, "metadata.content_hash": 1, "embedding": 1}):
+            source_id = d["metadata"]["source_id"]
+            if d["metadata"].get("content_hash") == by_id[source_id].metadata["content_hash"]:
+                vectors[source_id] = d["embedding"]
+    return vectors
+
+
+def vectors_for(target_collection, documents, since=None):
+    """Return ``({source_id: vector}, embedded_count)``, embedding only what MongoDB lacks."""
+    vectors = stored_vectors(target_collection, documents, since)
+    to_embed = [doc for doc in documents if doc.metadata["source_id"] not in vectors]
+    if to_embed:
+        vectors.update(embed_and_store(target_collection, to_embed))
+    return vectors, len(to_embed)
+
+
+def checkpoint_path(collection_name):
+    return os.path.join(CHECKPOINT_DIR, f"{collection_name}.json")
+
+
+def start_checkpoint(collection_name):
+    """Start time of the unfinished full rebuild of this collection, or a new one."""
+    path = checkpoint_path(collection_name)
+    if os.path.exists(path):
+        with open(path) as f:
+            started_at = json.load(f)["started_at"]
+        print(f"↩️ Resuming interrupted rebuild of {collection_name}")
+        return started_at
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    started_at = time.time()
+    with open(path, "w") as f:
+        json.dump({"started_at": started_at}, f)
+    return started_at
+
+
+def clear_checkpoint(collection_name):
+    try:
+        os.remove(checkpoint_path(collection_name))
+    except FileNotFoundError:
+        pass
+
+
+def remove_index(collection_name, index_dir, target_collection):
+    """Drop the store and stored embeddings of a collection with nothing left to index."""
+    if not has_store(index_dir):
+        return 0
+    removed = target_collection.delete_many({}).deleted_count
+    # Out of the way in one rename, like replace_dir, then deleted
+    old_dir = f"{index_dir}.old-{os.getpid()}-{threading.get_ident()}"
+    os.rename(index_dir, old_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"🗑️ {collection_name} has nothing left to index; removed its store and {removed} stored embeddings")
+    return removed
+
+
+def report_throughput(collection_name, written, started):
+    elapsed = time.perf_counter() - started
+    rate = written / elapsed if elapsed > 0 else 0.0
+    print(
+        f"⏱️ {collection_name}: embedded {written} documents in {elapsed:.2f}s "
+        f"({rate:.1f} docs/sec, peak RSS {peak_rss_mb():.0f} MB)"
+    )
+
+
+def finish(result, started):
+    result["seconds"] = round(time.perf_counter() - started, 2)
+    return result
+
+
+def ingest_collection(collection_name, full_rebuild=False):
+    """Bring one collection's embeddings and vector store up to date; returns a summary row."""
+    # Written next to the live store and swapped in at the end, so readers never see a partial one
+    index_dir = os.path.join(VECTOR_STORE_DIR, f"{collection_name}_faiss_index")
+    writer = CompactStoreWriter(f"{index_dir}.tmp-{os.getpid()}-{threading.get_ident()}")
+    try:
+        return _ingest_collection(collection_name, full_rebuild, index_dir, writer)
+    finally:
+        # Removes the temp dir unless it was swapped in
+        writer.abort()
+
+
+def _ingest_collection(collection_name, full_rebuild, index_dir, writer):
     print(f"\n🔄 Processing collection: {collection_name}")
+    started = time.perf_counter()
+    result = {"collection": collection_name, "status": "skipped", "documents": 0, "embedded": 0,
+              "reused": 0, "removed": 0, "vectors": 0, "seconds": 0.0}
     source_collection = db[collection_name]
     target_collection = db[f"{collection_name}_embeddings"]
 
@@ -33,75 +347,143 @@ for collection_name in collections:
     sample_doc = source_collection.find_one()
     if not sample_doc:
         print(f"⚠️ No documents found in {collection_name}")
-        continue
+        if has_store(index_dir):
+            result.update(status="removed", removed=remove_index(collection_name, index_dir, target_collection))
+        return finish(result, started)
     field_names = [key for key in sample_doc.keys() if key not in EXCLUDED_FIELDS]
     if not field_names:
         print(f"⚠️ No valid fields found in {collection_name}")
-        continue
+        return finish(result, started)
     print(f"🔍 Embedding fields: {', '.join(field_names)}")
 
-    # Load documents
-    documents = []
-    cursor = source_collection.find({field_name: {"$exists": True} for field_name in field_names})
-    for doc in cursor:
-        # Concatenate all field values into a single string
-        field_values = []
-        for field_name in field_names:
-            value = doc.get(field_name)
-            if value is not None:
-                field_values.append(str(value))  # Convert to string
-            else:
-                field_values.append("")
-        text = " ".join(field_values)
-        if not text.strip():
-            continue
+    ensure_embeddings_index(target_collection)
+    store = None if full_rebuild else load_index(index_dir)
+    # Rebuild when there is no usable index. A --full run re-embeds everything,
+    # but resumes from the vectors an interrupted run of the same rebuild stored.
+    rebuilding = store is None
+    since = start_checkpoint(collection_name) if full_rebuild else None
+    # {source_id: (position, content_hash)} of what the current store holds
+    indexed = {} if rebuilding else store.docs.source_index()
 
-        documents.append(
-            Document(
-                page_content=text,
-                metadata={
-                    "source_id": str(doc["_id"]),
-                    "source_collection": collection_name,
-                    "original_fields": {field_name: doc.get(field_name) for field_name in field_names}
-                }
-            )
+    seen, changed_ids = set(), set()
+    total = changed_count = embedded = 0
+    for batch in prefetch(iter_document_batches(source_collection, collection_name, field_names)):
+        total += len(batch)
+        seen.update(doc.metadata["source_id"] for doc in batch)
+        changed = [
+            doc for doc in batch
+            if indexed.get(doc.metadata["source_id"], (None, None))[1] != doc.metadata["content_hash"]
+        ]
+        if not changed:
+            continue
+        changed_count += len(changed)
+        changed_ids.update(doc.metadata["source_id"] for doc in changed)
+        vectors, batch_embedded = vectors_for(target_collection, changed, since)
+        embedded += batch_embedded
+        writer.add(
+            [doc.page_content for doc in changed],
+            [doc.metadata for doc in changed],
+            [vectors[doc.metadata["source_id"]] for doc in changed],
         )
 
-    if not documents:
+    if total == 0:
+        clear_checkpoint(collection_name)
         print(f"⚠️ No valid data found in {collection_name}")
-        continue
+        if store is not None:
+            store.close()
+        if has_store(index_dir):
+            result.update(status="removed", removed=remove_index(collection_name, index_dir, target_collection))
+        return finish(result, started)
 
-    try:
-        # Generate embeddings and update/insert in MongoDB
-        embedding_vectors = embeddings.embed_documents([doc.page_content for doc in documents])
-        for doc, embedding in zip(documents, embedding_vectors):
-            # Check if embedding exists for this source_id
-            existing_doc = target_collection.find_one({"metadata.source_id": doc.metadata["source_id"]})
-            if existing_doc:
-                # Update existing embedding
-                target_collection.update_one(
-                    {"metadata.source_id": doc.metadata["source_id"]},
-                    {
-                        "$set": {
-                            "text": doc.page_content,
-                            "metadata": doc.metadata,
-                            "embedding": embedding
-                        }
-                    }
-                )
-                print(f"🔄 Updated embedding for document {doc.metadata['source_id']} in '{collection_name}_embeddings'")
-            else:
-                # Insert new embedding
-                target_collection.insert_one({
-                    "text": doc.page_content,
-                    "metadata": doc.metadata,
-                    "embedding": embedding
-                })
-                print(f" Inserted new embedding for document {doc.metadata['source_id']} in '{collection_name}_embeddings'")
-
-        # Create and save FAISS index (overwrite existing)
-        vector_store = FAISS.from_documents(documents, embeddings)
-        vector_store.save_local(f"vector_store/{collection_name}_faiss_index")
-        print(f"✅ Stored/Updated {len(documents)} embeddings in MongoDB '{collection_name}_embeddings' and FAISS 'vector_store/{collection_name}_faiss_index'")
-    except Exception as e:
-        print(f"❌ Error while embedding '{collection_name}': {e}")
\ No newline at end of file
+    removed = [source_id for source_id in indexed if source_id not in seen]
+    if removed:
+        target_collection.delete_many({"metadata.source_id": {"$in": removed}})
+    if not rebuilding and not changed_count and not removed:
+        result.update(documents=total, vectors=store.ntotal)
+        store.close()
+        # The store is current, so a rebuild interrupted earlier has nothing left to resume
+        clear_checkpoint(collection_name)
+        print(f"✅ {collection_name} is up to date ({total} documents)")
+        result["status"] = "up to date"
+        return finish(result, started)
+
+    # Unchanged rows are copied over from the current store as they are
+    if store is not None:
+        writer.copy_from(store, [
+            position for source_id, (position, _) in indexed.items()
+            if source_id in seen and source_id not in changed_ids
+        ])
+    writer.close()
+    replace_dir(writer.dir_path, index_dir)
+    if store is not None:
+        store.close()
+    clear_checkpoint(collection_name)
+    result.update(documents=total, embedded=embedded, reused=changed_count - embedded,
+                  removed=len(removed), vectors=writer.count)
+    print(
+        f"✅ {collection_name}: {total} documents, embedded {embedded}, reused {changed_count - embedded}, "
+        f"removed {len(removed)} (index now {writer.count} vectors in '{index_dir}')"
+    )
+    report_throughput(collection_name, embedded, started)
+    result["status"] = "rebuilt" if rebuilding else "updated"
+    return finish(result, started)
+
+
+def print_summary(results):
+    columns = ["collection", "status", "documents", "embedded", "reused", "removed", "vectors", "seconds"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("\n📊 Ingestion summary")
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    print("  ".join("-" * widths[c] for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embed MongoDB collections into vector stores.")
+    parser.add_argument("--collections", nargs="+", help="collections to ingest (default: all)")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", "4")),
+                        help="collections ingested concurrently")
+    parser.add_argument("--full", action="store_true", default=FULL_REBUILD,
+                        help="re-embed everything and rebuild each index from scratch")
+    parser.add_argument("--unified", action="store_true", default=BUILD_UNIFIED_INDEX,
+                        help="also build the unified multi-collection index (an existing one is always kept current)")
+    args = parser.parse_args(argv)
+
+    all_collections = source_collections()
+    collections = args.collections or all_collections
+    started = time.perf_counter()
+
+    # Threads, not processes: the work is waiting on the embedding API and MongoDB,
+    # and the process-wide embed_semaphore caps API concurrency across all workers
+    results = []
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        futures = {pool.submit(ingest_collection, name, args.full): name for name in collections}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"❌ Error while embedding '{name}': {e}")
+                results.append({"collection": name, "status": "failed", "documents": 0, "embedded": 0,
+                                "reused": 0, "removed": 0, "vectors": 0, "seconds": 0.0})
+
+    # An existing unified index is searched whenever present, so keep it in step with the stores
+    unified_exists = os.path.isdir(os.path.join(VECTOR_STORE_DIR, UNIFIED_DIR_NAME))
+    stores_changed = any(r["status"] in ("updated", "rebuilt", "removed") for r in results)
+    if args.unified or (unified_exists and stores_changed):
+        print("\n🔄 Building unified index")
+        try:
+            unified = build_unified_index(VECTOR_STORE_DIR, all_collections, embeddings)
+            print(f"✅ Built unified {unified.kind} index with {unified.ntotal} vectors across {len(unified.collections)} collections")
+        except Exception as e:
+            print(f"❌ Error while building unified index: {e}")
+
+    if results:
+        print_summary(sorted(results, key=lambda r: r["collection"]))
+    print(f"⏱️ Total: {time.perf_counter() - started:.2f}s, peak RSS {peak_rss_mb():.0f} MB")
+    return 1 if any(r["status"] == "failed" for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
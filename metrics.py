@@ -0,0 +1,115 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Each stage keeps its most recent METRICS_WINDOW samples for the percentiles
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "2048"))
+# Fraction of requests profiled with cProfile (their top functions are logged)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+
+
+class Histogram:
+    """Latency samples for one stage: lifetime count/total/max plus a recent window."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def snapshot(self):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(percentile(50) * 1000, 2),
+            "p95_ms": round(percentile(95) * 1000, 2),
+            "p99_ms": round(percentile(99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+def observe(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block into the ``name`` histogram, whether or not it raises."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started_at)
+
+
+def snapshot():
+    with _lock:
+        return {name: histogram.snapshot() for name, histogram in sorted(_histograms.items())}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+# --- Sampled profiling ---
+# Only one cProfile can be active per process at a time, so concurrent requests skip it
+_profile_lock = threading.Lock()
+
+
+def should_profile(requested=False):
+    return requested or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+@contextmanager
+def profiled(enabled):
+    """Profile the enclosed block when ``enabled``; yields a dict whose "report" is filled on exit."""
+    result = {"report": None}
+    if not enabled or not _profile_lock.acquire(blocking=False):
+        yield result
+        return
+    profiler = cProfile.Profile()
+    try:
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active
+            yield result
+            return
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+            result["report"] = out.getvalue()
+    finally:
+        _profile_lock.release()
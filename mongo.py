@@ -0,0 +1,70 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+load_dotenv()
+MONGODB_URI = os.getenv("MONGODB_URI")
+DB_NAME = "pet-store-samyotech-in"
+
+# One pool per process, shared by the chatbot, structured queries and ingestion
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+# Collections the app writes itself; never ingested or searched
+ANSWER_CACHE_COLLECTION = "answer_cache"
+CHAT_HISTORY_COLLECTION = "chat_history"
+INTERNAL_COLLECTIONS = {CHAT_HISTORY_COLLECTION, ANSWER_CACHE_COLLECTION}
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide MongoClient, recreated after a fork (MongoClient is not fork-safe)."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(
+                    MONGODB_URI,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                )
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_db():
+    return get_client()[DB_NAME]
+
+
+class _DatabaseProxy:
+    """Module-level ``db`` that resolves to the current process's client on each use."""
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+
+db = _DatabaseProxy()
+
+
+def source_collections():
+    # All collections holding store data (exclude system collections, app-internal ones, and _embeddings collections)
+    return [
+        col for col in db.list_collection_names()
+        if col not in INTERNAL_COLLECTIONS
+        and not col.startswith("system.")
+        and not col.endswith("_embeddings")
+    ]
@@ -0,0 +1,263 @@
+import atexit
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import deque
+
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict, messages_from_dict
+
+from cache import LRUTTLCache
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; good enough for a budget
+    return len(text) // 4 + 1
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class _Session:
+    def __init__(self, max_turns, summary_max_chars):
+        # Recent (question, answer) pairs verbatim; older ones folded into summary lines
+        self.turns = deque()
+        self.summary = deque()
+        self.summary_chars = 0
+        self.max_turns = max_turns
+        self.summary_max_chars = summary_max_chars
+        self.lock = threading.Lock()
+        # Messages of this session known to be in MongoDB, and when that was last checked
+        self.stored = 0
+        self.checked_at = time.monotonic()
+
+    def add(self, question, answer):
+        self.turns.append((question, answer))
+        while len(self.turns) > self.max_turns:
+            self._summarize(*self.turns.popleft())
+
+    def _summarize(self, question, answer):
+        line = f"- Asked: {_clip(question, 120)} / Answered: {_clip(answer, 160)}"
+        self.summary.append(line)
+        self.summary_chars += len(line)
+        while self.summary and self.summary_chars > self.summary_max_chars:
+            self.summary_chars -= len(self.summary.popleft())
+
+
+class SessionMemory:
+    """Per-session conversation memory backed by the ``chat_history`` collection.
+
+    The last ``max_turns`` turns of each active session live in process; older
+    turns are condensed into short summary lines. A session is read from
+    MongoDB on its first use in this process (newest messages only) and read
+    again only when its stored message count (an indexed count, checked at
+    most every ``recheck_seconds``) shows another worker added turns. Idle
+    sessions expire after ``ttl`` seconds. Documents use the
+    MongoDBChatMessageHistory layout, so either can read what the other wrote.
+
+    With ``flush_interval=0`` every turn is written before ``append`` returns,
+    batched with whatever other requests appended meanwhile, so the next
+    request sees it whichever worker serves it. A positive interval writes
+    behind instead, which is only safe with a single worker.
+    """
+
+    def __init__(self, collection, max_turns=6, max_tokens=1000, summary_max_chars=1200,
+                 ttl=1800, max_sessions=10000, load_turns=20, flush_interval=0.0, flush_batch=200,
+                 recheck_seconds=1.0):
+        # A callable so each forked worker resolves its own client
+        self._collection = collection
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_max_chars = summary_max_chars
+        self.load_turns = load_turns
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.recheck_seconds = recheck_seconds
+        self.sessions = LRUTTLCache(maxsize=max_sessions, ttl=ttl)
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._writer = None
+        self._indexed = False
+        self.loads = 0
+        self.flushed = 0
+        atexit.register(self.flush)
+
+    # --- Reads ---
+    def _session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            # Make sure nothing this process wrote for the session is still buffered before reading back
+            with self._pending_lock:
+                buffered = any(doc["SessionId"] == session_id for doc in self._pending)
+            if buffered:
+                self.flush()
+        elif not self._is_current(session_id, session):
+            session = None
+        if session is None:
+            session = _Session(self.max_turns, self.summary_max_chars)
+            turns, session.stored = self._load(session_id)
+            for question, answer in turns:
+                session.add(question, answer)
+        # Re-storing on every use makes the TTL an idle timeout
+        self.sessions.set(session_id, session)
+        return session
+
+    def new_session(self):
+        """A fresh session id; it has no history yet, so it is never looked up in MongoDB."""
+        session_id = str(uuid.uuid4())
+        self.sessions.set(session_id, _Session(self.max_turns, self.summary_max_chars))
+        return session_id
+
+    def _is_current(self, session_id, session):
+        """False when MongoDB holds messages of this session that it does not have."""
+        now = time.monotonic()
+        if now - session.checked_at < self.recheck_seconds:
+            return True
+        with self._pending_lock:
+            if any(doc["SessionId"] == session_id for doc in self._pending):
+                # Our own turns are not written yet; nobody else is mid-conversation
+                return True
+        try:
+            stored = self._collection().count_documents({"SessionId": session_id})
+        except Exception as e:
+            print(f"❌ Could not check chat history: {e}")
+            return True
+        session.checked_at = now
+        return stored == session.stored
+
+    def _load(self, session_id):
+        """``([(question, answer), ...], stored message count)`` for the session."""
+        try:
+            if not self._indexed:
+                # Same index MongoDBChatMessageHistory creates; history reads are by session
+                self._collection().create_index("SessionId")
+                self._indexed = True
+            docs = list(
+                self._collection()
+                .find({"SessionId": session_id}, {"History": 1})
+                .sort("_id", -1)
+                .limit(self.load_turns * 2)
+            )
+            stored = self._collection().count_documents({"SessionId": session_id})
+        except Exception as e:
+            print(f"❌ Could not load chat history: {e}")
+            return [], 0
+        self.loads += 1
+        messages = messages_from_dict([json.loads(doc["History"]) for doc in reversed(docs)])
+        turns, question = [], None
+        for message in messages:
+            if message.type == "human":
+                question = message.content
+            elif message.type == "ai" and question is not None:
+                turns.append((question, message.content))
+                question = None
+        return turns, stored
+
+    def history(self, session_id):
+        """Summary plus recent turns as prompt text, within ``max_tokens``; "" for a new session."""
+        if not session_id:
+            return ""
+        session = self._session(session_id)
+        with session.lock:
+            turns = [f"User: {q}\nAssistant: {a}" for q, a in session.turns]
+            summary = "\n".join(session.summary)
+        # Drop the oldest material first until the history fits the budget
+        budget = self.max_tokens
+        kept = []
+        for turn in reversed(turns):
+            cost = estimate_tokens(turn)
+            if cost > budget:
+                break
+            kept.append(turn)
+            budget -= cost
+        parts = []
+        if summary and len(kept) == len(turns) and estimate_tokens(summary) <= budget:
+            parts.append(f"Earlier in the conversation:\n{summary}")
+        parts.extend(reversed(kept))
+        return "\n\n".join(parts)
+
+    def last_question(self, session_id):
+        if not session_id:
+            return None
+        session = self._session(session_id)
+        with session.lock:
+            return session.turns[-1][0] if session.turns else None
+
+    def fingerprint(self, session_id):
+        """Short digest of the history a prompt would see, or None when there is none."""
+        history = self.history(session_id)
+        return hashlib.sha256(history.encode("utf-8")).hexdigest()[:16] if history else None
+
+    # --- Writes ---
+    def append(self, session_id, question, answer):
+        if not session_id:
+            return
+        session = self._session(session_id)
+        with session.lock:
+            session.add(question, answer)
+        docs = [
+            {"SessionId": session_id, "History": json.dumps(message_to_dict(message))}
+            for message in (HumanMessage(content=question), AIMessage(content=answer))
+        ]
+        with self._pending_lock:
+            self._pending.extend(docs)
+            full = len(self._pending) >= self.flush_batch
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        self._ensure_writer()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                docs, self._pending = self._pending, []
+            if not docs:
+                return
+            try:
+                self._collection().insert_many(docs, ordered=True)
+                self.flushed += len(docs)
+            except Exception as e:
+                print(f"❌ Could not write chat history ({len(docs)} messages): {e}")
+                return
+            written = {}
+            for doc in docs:
+                written[doc["SessionId"]] = written.get(doc["SessionId"], 0) + 1
+            for session_id, count in written.items():
+                session = self.sessions.get(session_id)
+                if session is not None:
+                    with session.lock:
+                        session.stored += count
+
+    def _ensure_writer(self):
+        # Threads do not survive fork(), so a worker starts its own on first write
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._pending_lock:
+            if self._writer is not None and self._writer.is_alive():
+                return
+
+            def _write_behind():
+                while True:
+                    self._wakeup.wait(self.flush_interval)
+                    self._wakeup.clear()
+                    self.flush()
+
+            self._writer = threading.Thread(target=_write_behind, name="session-memory-writer", daemon=True)
+            self._writer.start()
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "max_turns": self.max_turns,
+            "max_tokens": self.max_tokens,
+            "loads": self.loads,
+            "pending_writes": len(self._pending),
+            "flushed_messages": self.flushed,
+        }
@@ -1,17 +1,14 @@
 import re
-from pymongo import MongoClient
+from pymongo import ASCENDING
+from pymongo.collation import Collation
 import os
 from dotenv import load_dotenv
 from bson import ObjectId
 from datetime import datetime
+from mongo import db
 
 # Load environment variables
 load_dotenv()
-MONGODB_URI = os.getenv("MONGODB_URI")
-
-# --- MongoDB Client ---
-client = MongoClient(MONGODB_URI)
-db = client["pet-store-samyotech-in"]
 
 # Map user-friendly entity names to MongoDB collection names
 COLLECTION_MAP = {
@@ -45,19 +42,95 @@ COLLECTION_MAP = {
     'settings': 'settings',
 }
 
-# Patterns for intent detection
+# Case-insensitive comparison (strength 2 ignores case but not accents).
+# Queries must pass the same collation as the index to be able to use it.
+CASE_INSENSITIVE = Collation(locale='en', strength=2)
+
+# Set to print any structured query shape that still scans a whole collection
+EXPLAIN_CHECK = os.getenv("STRUCTURED_EXPLAIN_CHECK") == "1"
+
+# Page size for 'list' answers
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "10"))
+
+# Fields the list formatters read; nothing else is fetched from the server
+PRODUCT_FIELDS = ['productName', 'price', 'originalPrice', 'discount', 'quantity']
+ORDER_FIELDS = ['user.name', 'userId', 'createdAt', 'amount', 'total', 'orderStatus', 'status']
+GENERIC_NAME_FIELDS = ['name', 'productName', 'title', 'username', 'email']
+
+# Patterns for intent detection. Matches skip RAG, so the verbs are anchored:
+# "account settings", "discount products" or "budget orders" must not match.
 COUNT_PATTERNS = [
-    r"how many (.+?)\?",
-    r"count (all )?(.+?)$",
-    r"what(?:'s| is) the total number of (.+?)\?",
+    r"^how many (.+?)\?",
+    r"\bcount (all )?(.+?)$",
+    r"^what(?:'s| is) the total number of (.+?)\?",
 ]
 LIST_PATTERNS = [
-    r"list (all )?(.+?)$",
-    r"show me (all )?(.+?)$",
-    r"display (all )?(.+?)$",
-    r"get (all )?(.+?)$",
+    r"^\s*list (all )?(.+?)$",
+    r"^\s*show me (all )?(.+?)$",
+    r"^\s*display (all )?(.+?)$",
+    r"^\s*get (all )?(.+?)$",
 ]
 
+def ensure_indexes():
+    """Create the indexes the structured queries rely on (safe to call repeatedly)."""
+    specs = [
+        ('users', 'name', CASE_INSENSITIVE),
+        ('users', 'email', CASE_INSENSITIVE),
+        ('categories', 'name', CASE_INSENSITIVE),
+        ('orders', 'userId', None),
+        ('orders', 'createdAt', None),
+        ('subcategories', 'categoryId', None),
+    ]
+    for collection, field, collation in specs:
+        kwargs = {'name': f"{field}_ci", 'collation': collation} if collation else {}
+        try:
+            db[collection].create_index([(field, ASCENDING)], **kwargs)
+        except Exception as e:
+            print(f"❌ Could not create index on {collection}.{field}: {e}")
+
+def _plan_stages(plan):
+    stages = [plan.get('stage')]
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+def find_collscans():
+    """Explain each structured query shape and return the labels of those doing a COLLSCAN.
+
+    The partial-name fallback in ``list_orders_by_user`` is left out: an
+    unanchored regex always scans, which is why it only runs after the
+    indexed exact match misses.
+    """
+    day = datetime(2024, 1, 1)
+    shapes = [
+        ('categories by name', 'categories', {'name': 'x'}, CASE_INSENSITIVE),
+        ('users by name or email', 'users', {'$or': [{'name': 'x'}, {'email': 'x'}]}, CASE_INSENSITIVE),
+        ('orders by user', 'orders', {'userId': ObjectId()}, None),
+        ('orders by date', 'orders', {'createdAt': {'$gte': day, '$lte': day}}, None),
+        ('subcategories by category', 'subcategories', {'categoryId': ObjectId()}, None),
+    ]
+    scans = []
+    for label, collection, query, collation in shapes:
+        cursor = db[collection].find(query)
+        if collation:
+            cursor = cursor.collation(collation)
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        if 'COLLSCAN' in _plan_stages(plan):
+            scans.append(label)
+    return scans
+
+def prepare_indexes():
+    ensure_indexes()
+    if EXPLAIN_CHECK:
+        try:
+            for label in find_collscans():
+                print(f"⚠️ Structured query still does a COLLSCAN: {label}")
+        except Exception as e:
+            print(f"❌ Explain check failed: {e}")
+
 def clean_entity(entity):
     # Remove common trailing phrases
     entity = entity.lower().strip()
@@ -169,12 +242,115 @@ def format_generic(doc):
     summary = ', '.join(f"{k}: {v}" for k, v in items[:3])
     return summary
 
-def handle_structured_query(intent, entity):
-    entity = clean_entity(entity)
+_generic_fields = {}
+
+def list_fields(collection):
+    if collection == 'products':
+        return PRODUCT_FIELDS
+    if collection == 'orders':
+        return ORDER_FIELDS
+    # format_generic shows the first name-like field, else the first three fields;
+    # decide which from one sample document and remember it
+    if collection not in _generic_fields:
+        sample = db[collection].find_one() or {}
+        fields = [key for key in GENERIC_NAME_FIELDS if key in sample]
+        if not fields:
+            fields = [key for key in sample if key != '_id'][:3]
+        _generic_fields[collection] = fields
+    return _generic_fields[collection]
+
+def parse_cursor(cursor):
+    """ObjectId of a ``next_cursor``; raises ValueError for anything else."""
+    if not isinstance(cursor, str) or not ObjectId.is_valid(cursor):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return ObjectId(cursor)
+
+class ListAnswer(str):
+    """A 'list' answer that also carries the ``next_cursor`` of the page after it."""
+
+    def __new__(cls, text, next_cursor=None):
+        answer = super().__new__(cls, text)
+        answer.next_cursor = next_cursor
+        return answer
+
+def format_list_item(collection, doc):
+    if collection == 'orders':
+        return format_order(doc)
+    doc = {k: v for k, v in doc.items() if k != '_id'}
+    if collection == 'products':
+        return format_product(doc)
+    return format_generic(doc)
+
+def list_collection_page(collection, page=1, after=None, page_size=LIST_PAGE_SIZE):
+    """Fetch one page of ``collection`` in ``_id`` order with only the displayed fields.
+
+    ``after`` is the ``next_cursor`` of the previous page and turns the query into
+    an indexed ``_id`` range scan; without it the page number is skipped to.
+    ``offset`` in the result is how many documents come before this page.
+    """
+    page = max(int(page or 1), 1)
+    query = {}
+    offset = skip = (page - 1) * page_size
+    if after:
+        after_id = parse_cursor(after)
+        query['_id'] = {'$gt': after_id}
+        skip = 0
+        # The page number comes from the cursor; counted on the _id index, no documents read
+        offset = db[collection].count_documents({'_id': {'$lte': after_id}})
+        page = offset // page_size + 1
+    projection = {field: 1 for field in list_fields(collection)}
+    docs = list(db[collection].find(query, projection).sort('_id', 1).skip(skip).limit(page_size))
+    # Collection metadata count; no scan
+    total = db[collection].estimated_document_count()
+    return {
+        'collection': collection,
+        'page': page,
+        'page_size': page_size,
+        'offset': offset,
+        'total': total,
+        'items': [format_list_item(collection, doc) for doc in docs],
+        'next_cursor': str(docs[-1]['_id']) if len(docs) == page_size else None,
+    }
+
+def list_entity_page(entity, page=1, after=None):
+    collection = resolve_collection(clean_entity(entity))
+    if not collection:
+        return None
+    return list_collection_page(collection, page, after)
+
+def resolve_collection(entity):
+    # Try direct match
+    collection = COLLECTION_MAP.get(entity)
+    # Try plural/singular fallback
+    if not collection:
+        if entity.endswith('s'):
+            collection = COLLECTION_MAP.get(entity[:-1])
+        elif not entity.endswith('s'):
+            collection = COLLECTION_MAP.get(entity + 's')
+    return collection
+
+def answer_structured_query(question, page=1, after=None):
+    """Answer straight from MongoDB when the question matches an intent.
+
+    Returns ``(intent, answer)``; ``answer`` is None when the question should
+    go through RAG instead (no intent, or an entity we have no collection for).
+    """
+    intent, entity = detect_intent(question)
+    if intent is None:
+        return None, None
+    if intent in ('count', 'list') and not resolve_collection(clean_entity(entity)):
+        return intent, None
+    return intent, handle_structured_query(intent, entity, page, after)
+
+def handle_structured_query(intent, entity, page=1, after=None):
+    # Date ranges arrive as a (start, end) tuple. Names, emails and ids are
+    # looked up as typed; only collection names go through clean_entity.
+    if isinstance(entity, str):
+        entity = entity.lower().strip(" ?.")
     # Relational: subcategories under a category
     if intent == 'list_subcategories_by_category':
         # Find the category
-        cat = db['categories'].find_one({'name': {'$regex': f'^{entity}$', '$options': 'i'}})
+        cat = db['categories'].find_one({'name': entity}, collation=CASE_INSENSITIVE)
         if not cat:
             return f"No category found with name '{entity}'."
         cat_id = cat['_id']
@@ -185,10 +361,18 @@ def handle_structured_query(intent, entity):
         return f"Subcategories under '{entity}' category:\n" + "\n".join(lines)
     # Orders by user
     if intent == 'list_orders_by_user':
-        user = db['users'].find_one({'$or': [
-            {'name': {'$regex': entity, '$options': 'i'}},
-            {'email': {'$regex': entity, '$options': 'i'}}
-        ]})
+        # Exact name/email first: served by the case-insensitive indexes
+        user = db['users'].find_one(
+            {'$or': [{'name': entity}, {'email': entity}]},
+            collation=CASE_INSENSITIVE
+        )
+        if not user:
+            # Partial match still scans; escape the input so it is matched literally
+            pattern = re.escape(entity)
+            user = db['users'].find_one({'$or': [
+                {'name': {'$regex': pattern, '$options': 'i'}},
+                {'email': {'$regex': pattern, '$options': 'i'}}
+            ]})
         if not user:
             return f"No user found matching '{entity}'."
         user_id = user['_id']
@@ -232,34 +416,22 @@ def handle_structured_query(intent, entity):
             return f"No orders found between {start_date} and {end_date}."
         lines = [f"{i+1}. {format_order(o)}" for i, o in enumerate(orders)]
         return f"Orders from {start_date} to {end_date}:\n" + "\n".join(lines)
-    # Try direct match
-    collection = COLLECTION_MAP.get(entity)
-    # Try plural/singular fallback
-    if not collection:
-        if entity.endswith('s'):
-            collection = COLLECTION_MAP.get(entity[:-1])
-        elif not entity.endswith('s'):
-            collection = COLLECTION_MAP.get(entity + 's')
+    collection = resolve_collection(clean_entity(entity))
     if not collection:
         return f"Sorry, I can't find information for '{entity}'."
     if intent == 'count':
         count = db[collection].count_documents({})
         return f"There are {count} {collection} in the store."
     elif intent == 'list':
-        docs = list(db[collection].find({}, {'_id': 0}))
-        if not docs:
+        result = list_collection_page(collection, page, after)
+        if not result['items']:
             return f"No {collection} found."
-        preview = docs[:10]
-        lines = []
-        if collection == 'products':
-            for i, doc in enumerate(preview, 1):
-                lines.append(f"{i}. {format_product(doc)}")
-        elif collection == 'orders':
-            for i, doc in enumerate(preview, 1):
-                lines.append(f"{i}. {format_order(doc)}")
-        else:
-            for i, doc in enumerate(preview, 1):
-                lines.append(f"{i}. {format_generic(doc)}")
-        more = f"\n...and {len(docs)-10} more." if len(docs) > 10 else ""
-        return f"Here are the {collection} in the store:\n" + "\n".join(lines) + more
+        start = result['offset']
+        lines = [f"{start + i}. {item}" for i, item in enumerate(result['items'], 1)]
+        remaining = result['total'] - start - len(lines)
+        more = f"\n...and {remaining} more." if remaining > 0 else ""
+        return ListAnswer(
+            f"Here are the {collection} in the store:\n" + "\n".join(lines) + more,
+            result['next_cursor'],
+        )
     return "Sorry, I can't handle that type of query yet." 
\ No newline at end of file
@@ -0,0 +1,186 @@
+import json
+import os
+import shutil
+import time
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+
+from doc_store import (
+    DocList, DocTable, create_doc_table, finish_doc_table, has_store, insert_docs, load_store, new_generation,
+    store_contents,
+)
+
+UNIFIED_DIR_NAME = "unified_index"
+UNIFIED_FILES = ("index.faiss", "tags.npy", "docs.sqlite", "meta.json")
+
+# Index type is picked from the corpus size: exact search while it is cheap,
+# then HNSW, then IVF once the graph would get too large to keep in memory.
+FLAT_MAX_VECTORS = int(os.getenv("UNIFIED_FLAT_MAX_VECTORS", "20000"))
+HNSW_MAX_VECTORS = int(os.getenv("UNIFIED_HNSW_MAX_VECTORS", "500000"))
+HNSW_M = 32
+IVF_NPROBE = int(os.getenv("UNIFIED_IVF_NPROBE", "16"))
+
+
+def _build_faiss_index(vectors):
+    n, dimension = vectors.shape
+    if n <= FLAT_MAX_VECTORS:
+        index = faiss.IndexFlatL2(dimension)
+        kind = "flat"
+    elif n <= HNSW_MAX_VECTORS:
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M)
+        kind = "hnsw"
+    else:
+        nlist = int(4 * np.sqrt(n))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, nlist)
+        sample = vectors[np.random.default_rng(0).choice(n, size=min(n, nlist * 64), replace=False)]
+        index.train(sample)
+        kind = "ivf"
+    index.add(vectors)
+    return index, kind
+
+
+class UnifiedIndex:
+    """One FAISS index over every collection, with an int16 collection tag per vector."""
+
+    def __init__(self, index, tags, collections, docs, kind):
+        self.index = index
+        self.tags = tags
+        self.collections = list(collections)
+        self.tag_of = {name: i for i, name in enumerate(self.collections)}
+        # docs.get(positions) returns the (page_content, metadata) pairs stored there
+        self.docs = docs
+        self.kind = kind
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @classmethod
+    def from_collection_stores(cls, stores):
+        """Build from ``{collection: store}`` reusing their stored vectors (no re-embedding)."""
+        collections, vectors, tags, docs = [], [], [], DocList()
+        for collection, store in stores.items():
+            store_vectors, rows = store_contents(store)
+            n = len(store_vectors)
+            if n == 0:
+                continue
+            tag = len(collections)
+            collections.append(collection)
+            vectors.append(store_vectors)
+            tags.append(np.full(n, tag, dtype=np.int16))
+            docs.extend(rows)
+        if not vectors:
+            raise ValueError("No vectors to build a unified index from")
+        matrix = np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+        index, kind = _build_faiss_index(matrix)
+        return cls(index, np.concatenate(tags), collections, docs, kind)
+
+    def save(self, dir_path):
+        # Write next to the target, then swap directories so readers never see a partial index
+        tmp_path = f"{dir_path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        faiss.write_index(self.index, os.path.join(tmp_path, "index.faiss"))
+        np.save(os.path.join(tmp_path, "tags.npy"), self.tags)
+        generation = new_generation()
+        conn = create_doc_table(os.path.join(tmp_path, "docs.sqlite"), generation)
+        for start in range(0, len(self.docs), 1000):
+            rows = self.docs[start:start + 1000]
+            insert_docs(conn, start, [text for text, _ in rows], [metadata for _, metadata in rows])
+        finish_doc_table(conn)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({
+                "collections": self.collections,
+                "kind": self.kind,
+                "ntotal": self.ntotal,
+                "generation": generation,
+                "built_at": time.time(),
+            }, f)
+        old_path = f"{dir_path}.old-{os.getpid()}"
+        if os.path.exists(dir_path):
+            os.rename(dir_path, old_path)
+        os.rename(tmp_path, dir_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, dir_path):
+        with open(os.path.join(dir_path, "meta.json")) as f:
+            meta = json.load(f)
+        index = faiss.read_index(os.path.join(dir_path, "index.faiss"))
+        if meta["kind"] == "ivf":
+            index.nprobe = IVF_NPROBE
+        tags = np.load(os.path.join(dir_path, "tags.npy"))
+        docs = DocTable(os.path.join(dir_path, "docs.sqlite"), meta.get("generation"))
+        return cls(index, tags, meta["collections"], docs, meta["kind"])
+
+    def search(self, query_vector, k, collections=None, quotas=None, default_quota=None):
+        """Return up to ``k`` ``(score, doc)`` pairs from a single index search.
+
+        ``collections`` restricts the search to those names; ``quotas`` caps how
+        many hits one collection may contribute (``default_quota`` for the rest).
+        The search over-fetches and widens until the filters are satisfied.
+        """
+        if self.ntotal == 0:
+            return []
+        allowed = None
+        if collections is not None:
+            allowed = np.array([self.tag_of[c] for c in collections if c in self.tag_of], dtype=np.int16)
+            if allowed.size == 0:
+                return []
+        limits = {}
+        if quotas or default_quota:
+            for name, tag in self.tag_of.items():
+                limits[tag] = (quotas or {}).get(name, default_quota)
+
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        fetch = k if allowed is None and not limits else k * 4
+        while True:
+            fetch = min(fetch, self.ntotal)
+            if self.kind == "hnsw":
+                self.index.hnsw.efSearch = max(64, fetch)
+            distances, ids = self.index.search(query, fetch)
+            distances, ids = distances[0], ids[0]
+            valid = ids >= 0
+            distances, ids = distances[valid], ids[valid]
+            hit_tags = self.tags[ids]
+            if allowed is not None:
+                keep = np.isin(hit_tags, allowed)
+                distances, ids, hit_tags = distances[keep], ids[keep], hit_tags[keep]
+
+            picked, taken = [], {}
+            for score, i, tag in zip(distances.tolist(), ids.tolist(), hit_tags.tolist()):
+                limit = limits.get(tag)
+                if limit is not None and taken.get(tag, 0) >= limit:
+                    continue
+                taken[tag] = taken.get(tag, 0) + 1
+                picked.append((score, i, tag))
+                if len(picked) == k:
+                    break
+            if len(picked) == k or fetch >= self.ntotal:
+                break
+            fetch *= 4
+
+        results = []
+        rows = self.docs.get([i for _, i, _ in picked])
+        for (score, i, tag), (page_content, metadata) in zip(picked, rows):
+            doc = Document(
+                page_content=page_content,
+                metadata={**metadata, "collection": self.collections[tag], "score": float(score)},
+            )
+            results.append((float(score), doc))
+        return results
+
+
+def build_unified_index(base_dir, collections, embeddings):
+    """Merge the saved per-collection indexes under ``base_dir`` into one unified index."""
+    stores = {}
+    for collection in collections:
+        dir_path = os.path.join(base_dir, f"{collection}_faiss_index")
+        if not has_store(dir_path):
+            continue
+        stores[collection] = load_store(dir_path, embeddings)
+    unified = UnifiedIndex.from_collection_stores(stores)
+    unified.save(os.path.join(base_dir, UNIFIED_DIR_NAME))
+    return unified
@@ -0,0 +1,250 @@
+import hashlib
+import os
+import threading
+import time
+
+from doc_store import CompactStore, has_store, load_store, store_files
+from unified_index import UNIFIED_DIR_NAME, UNIFIED_FILES, UnifiedIndex
+
+INDEX_SUFFIX = "_faiss_index"
+
+
+class VectorStoreRegistry:
+    """Process-wide cache of the vector stores under ``base_dir``.
+
+    Every store is opened once and kept resident (compact stores map their
+    vectors instead of reading them). A watcher thread polls the index files
+    and reloads a single collection when its files change; the new store is
+    published by replacing the whole dict, so readers never take a lock.
+    """
+
+    def __init__(self, base_dir, embeddings, collections=None, settle_seconds=2.0):
+        self.base_dir = base_dir
+        self.embeddings = embeddings
+        # Restrict to these collection names (None = everything found on disk)
+        self.collections = collections
+        # Skip files modified less than this many seconds ago (save still in progress)
+        self.settle_seconds = settle_seconds
+        self._stores = {}
+        self._stats = {}
+        # (UnifiedIndex, stats) swapped as one tuple, or None when not built
+        self._unified = None
+        # Found missing on the previous poll; dropped only if still missing on the next
+        self._missing = set()
+        self._unified_missing = False
+        self._loaded = False
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._watcher = None
+
+    def index_dir(self, collection):
+        return os.path.join(self.base_dir, f"{collection}{INDEX_SUFFIX}")
+
+    def discover(self):
+        if not os.path.isdir(self.base_dir):
+            return []
+        found = []
+        for entry in sorted(os.listdir(self.base_dir)):
+            if not entry.endswith(INDEX_SUFFIX):
+                continue
+            collection = entry[: -len(INDEX_SUFFIX)]
+            if self.collections is not None and collection not in self.collections:
+                continue
+            if has_store(os.path.join(self.base_dir, entry)):
+                found.append(collection)
+        return found
+
+    def _signature(self, collection):
+        dir_path = self.index_dir(collection)
+        return self._files_signature(dir_path, store_files(dir_path))
+
+    def _files_signature(self, dir_path, file_names):
+        sig = []
+        for name in file_names:
+            try:
+                st = os.stat(os.path.join(dir_path, name))
+            except FileNotFoundError:
+                return None
+            sig.append((st.st_mtime_ns, st.st_size))
+        return tuple(sig)
+
+    def _is_settled(self, signature):
+        newest = max(mtime for mtime, _ in signature) / 1e9
+        return time.time() - newest >= self.settle_seconds
+
+    def _load(self, collection, signature):
+        dir_path = self.index_dir(collection)
+        started = time.perf_counter()
+        store = load_store(dir_path, self.embeddings)
+        compact = isinstance(store, CompactStore)
+        stats = {
+            "format": "compact" if compact else "pickle",
+            "load_seconds": round(time.perf_counter() - started, 4),
+            "vectors": store.ntotal if compact else store.index.ntotal,
+            "dimension": store.dimension if compact else store.index.d,
+            "index_bytes": signature[0][1],
+            "docstore_bytes": signature[1][1],
+            "loaded_at": time.time(),
+            "signature": signature,
+        }
+        return store, stats
+
+    def _load_unified(self, signature):
+        started = time.perf_counter()
+        unified = UnifiedIndex.load(os.path.join(self.base_dir, UNIFIED_DIR_NAME))
+        stats = {
+            "load_seconds": round(time.perf_counter() - started, 4),
+            "vectors": unified.ntotal,
+            "kind": unified.kind,
+            "collections": len(unified.collections),
+            "bytes": sum(size for _, size in signature),
+            "loaded_at": time.time(),
+            "signature": signature,
+        }
+        return unified, stats
+
+    def _refresh_unified(self, force=False):
+        signature = self._files_signature(os.path.join(self.base_dir, UNIFIED_DIR_NAME), UNIFIED_FILES)
+        if signature is None:
+            # Ingest swaps the directory with two renames; don't drop the index in that gap
+            if self._unified is None or (not force and not self._unified_missing):
+                self._unified_missing = self._unified is not None
+                return False
+            self._unified = None
+            self._unified_missing = False
+            return True
+        self._unified_missing = False
+        if not force and not self._is_settled(signature):
+            return False
+        if self._unified is not None and self._unified[1]["signature"] == signature:
+            return False
+        try:
+            self._unified = self._load_unified(signature)
+            print(f"✅ Loaded unified FAISS index ({self._unified[0].ntotal} vectors)")
+            return True
+        except Exception as e:
+            print(f"❌ Could not load unified FAISS index: {e}")
+            return False
+
+    def _load_all_locked(self):
+        stores, stats = {}, {}
+        for collection in self.discover():
+            signature = self._signature(collection)
+            if signature is None:
+                continue
+            try:
+                stores[collection], stats[collection] = self._load(collection, signature)
+                print(f"✅ Loaded FAISS index for collection: {collection}")
+            except Exception as e:
+                print(f"❌ Could not load FAISS index for '{collection}': {e}")
+        self._stores, self._stats = stores, stats
+        self._missing = set()
+        self._refresh_unified(force=True)
+        self._loaded = True
+        print(f"🎯 Total vector stores resident: {len(stores)}")
+
+    def load_all(self):
+        """Load every index from disk, replacing whatever is resident."""
+        with self._write_lock:
+            self._load_all_locked()
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._write_lock:
+                if not self._loaded:
+                    self._load_all_locked()
+
+    def refresh(self):
+        """Reload only the collections whose index files changed; returns their names."""
+        with self._write_lock:
+            stores, stats = dict(self._stores), dict(self._stats)
+            changed = []
+            present = set(self.discover())
+            for collection in present:
+                signature = self._signature(collection)
+                if signature is None or not self._is_settled(signature):
+                    continue
+                if stats.get(collection, {}).get("signature") == signature:
+                    continue
+                try:
+                    stores[collection], stats[collection] = self._load(collection, signature)
+                    changed.append(collection)
+                    print(f"🔁 Reloaded FAISS index for collection: {collection}")
+                except Exception as e:
+                    print(f"❌ Could not reload FAISS index for '{collection}': {e}")
+            # A store directory is briefly absent while ingest swaps it in, so only
+            # drop a collection once it is missing on two consecutive polls
+            missing = set(stores) - present
+            for collection in missing & self._missing:
+                del stores[collection]
+                del stats[collection]
+                changed.append(collection)
+            self._missing = missing - self._missing
+            if changed:
+                # Publish a new dict; requests already holding the old one keep using it
+                self._stores, self._stats = stores, stats
+            if self._refresh_unified():
+                changed.append(UNIFIED_DIR_NAME)
+            return changed
+
+    def stores(self):
+        """Snapshot of ``{collection: store}``; safe to iterate without locking."""
+        return self._stores
+
+    def version(self):
+        """Stamp that changes whenever any resident index is reloaded, added or dropped."""
+        unified = self._unified
+        parts = sorted((name, s["signature"]) for name, s in self._stats.items())
+        parts.append(unified[1]["signature"] if unified else None)
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+    def unified(self):
+        """The resident :class:`UnifiedIndex`, or None if it has not been built."""
+        entry = self._unified
+        return entry[0] if entry is not None else None
+
+    def stats(self):
+        snapshot = self._stats
+        unified = self._unified
+        return {
+            "unified": {k: v for k, v in unified[1].items() if k != "signature"} if unified else None,
+            "collections": {
+                name: {k: v for k, v in s.items() if k != "signature"}
+                for name, s in snapshot.items()
+            },
+            "total_vectors": sum(s["vectors"] for s in snapshot.values()),
+            "total_index_bytes": sum(s["index_bytes"] + s["docstore_bytes"] for s in snapshot.values()),
+            "total_load_seconds": round(sum(s["load_seconds"] for s in snapshot.values()), 4),
+        }
+
+    def start_watcher(self, interval):
+        # A thread started before fork() is gone in the child, so check liveness
+        if (self._watcher is not None and self._watcher.is_alive()) or interval <= 0:
+            return
+        self._stop.clear()
+
+        def _watch():
+            while True:
+                self._wake.wait(interval)
+                self._wake.clear()
+                if self._stop.is_set():
+                    return
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"❌ Vector store refresh failed: {e}")
+
+        self._watcher = threading.Thread(target=_watch, name="vector-registry-watcher", daemon=True)
+        self._watcher.start()
+
+    def refresh_soon(self):
+        """Wake the watcher now, e.g. after a search hit a store replaced on disk."""
+        self._wake.set()
+
+    def stop_watcher(self):
+        self._stop.set()
+        self._wake.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None